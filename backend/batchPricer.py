@@ -0,0 +1,73 @@
+from backend.financialSim import financialEstimator
+import numpy as np
+import pandas as pd
+
+
+# financialEstimator.__init__ arguments, in order, with their defaults (None = required)
+PARAMETERS = {
+    'rent_price_growth': None,
+    'rent_price': None,
+    'house_price_growth': None,
+    'house_price': None,
+    'monthly_mortgage_interes': None,
+    'intallment_threshold': None,
+    'savings_per_month': None,
+    'etf_growth': None,
+    'initial_etf_savings': 0,
+}
+
+
+def price_batch(params, bounds = None, chunk_size = None, max_cells = 2**22):
+    """Optimal (months to wait, mortgage years) for many parameter sets.
+
+    `params` is a DataFrame (or anything pandas turns into one, such as a
+    structured array) with one column per `financialEstimator.__init__`
+    argument; `initial_etf_savings` is optional. Every chunk of rows is priced
+    as a single (rows x years x months) tensor over the integer points of
+    `bounds`, with `chunk_size` rows per chunk (by default as many as fit in
+    `max_cells` tensor cells).
+
+    Returns a DataFrame aligned with `params` holding months_to_wait,
+    mortgage_years, cost_function and payments; rows without any feasible
+    point get NaN months/years/payments and an infinite cost."""
+    params = pd.DataFrame(params)
+    missing = [name for name, default in PARAMETERS.items() if default is None and name not in params.columns]
+    if missing:
+        raise ValueError(f"Missing parameter columns: {missing}")
+
+    bounds = financialEstimator.DEFAULT_BOUNDS if bounds is None else bounds
+    months_wait = np.arange(bounds[0][0], bounds[0][1] + 1, dtype = int)
+    mortgage_years = np.arange(bounds[1][0], bounds[1][1] + 1, dtype = int)
+    if chunk_size is None:
+        chunk_size = max(1, max_cells // (len(months_wait) * len(mortgage_years)))
+
+    values = {
+        name: params[name].to_numpy(dtype = float) if name in params.columns else np.full(len(params), float(default))
+        for name, default in PARAMETERS.items()
+    }
+
+    result = np.full((len(params), 4), np.nan)
+    for start in range(0, len(params), chunk_size):
+        rows = slice(start, start + chunk_size)
+        chunk = {name: column[rows, np.newaxis, np.newaxis] for name, column in values.items()}
+        threshold = chunk.pop('intallment_threshold')
+
+        components = financialEstimator.parametric_components(
+                        months_wait = months_wait[np.newaxis, np.newaxis, :],
+                        mortgage_years = mortgage_years[np.newaxis, :, np.newaxis],
+                        **chunk
+                        )
+        Z = financialEstimator.masked_cost(components, threshold).reshape(len(threshold), -1)
+
+        best = np.argmin(Z, axis = 1)
+        cost = Z[np.arange(len(best)), best]
+        feasible = np.isfinite(cost)
+        j, i = np.unravel_index(best, (len(mortgage_years), len(months_wait)))
+        payments = np.broadcast_to(components['monthly_payments'], (len(best), len(mortgage_years), len(months_wait)))[np.arange(len(best)), j, i]
+
+        result[rows, 0] = np.where(feasible, months_wait[i], np.nan)
+        result[rows, 1] = np.where(feasible, mortgage_years[j], np.nan)
+        result[rows, 2] = cost
+        result[rows, 3] = np.where(feasible, payments, np.nan)
+
+    return pd.DataFrame(result, index = params.index, columns = ['months_to_wait', 'mortgage_years', 'cost_function', 'payments'])
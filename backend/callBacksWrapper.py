@@ -1,61 +1,239 @@
 import numpy as np
+import time
+
+
+class evaluationRecorder:
+    """Compact store of (input, result) evaluations in typed NumPy arrays.
+
+    Policies:
+        'full'          keeps every evaluation (buffers grow by doubling)
+        'improvements'  keeps the first evaluation and every strict decrease
+        'ring'          keeps the latest `size` evaluations
+        'reservoir'     keeps a uniform random sample of `size` evaluations
+    """
+    POLICIES = ('full', 'improvements', 'ring', 'reservoir')
+
+    def __init__(self, policy = 'full', size = None, capacity = 1024, dtype = np.float64, seed = None):
+        if policy not in evaluationRecorder.POLICIES:
+            raise ValueError(f"Unknown recording policy '{policy}', expected one of {evaluationRecorder.POLICIES}")
+        if policy in ('ring', 'reservoir') and not size:
+            raise ValueError(f"The '{policy}' policy needs a positive size")
+
+        self.policy = policy
+        self.size = size
+        self.dtype = dtype
+        self.seed = seed
+        self.seen = 0 # evaluations offered to the recorder
+        self._count = 0 # evaluations currently stored
+        self._head = 0 # next slot to overwrite in ring mode
+        self._inp = None # allocated on the first add, once the input dimension is known
+        self._res = np.empty(size if policy in ('ring', 'reservoir') else capacity, dtype = dtype)
+        self._rng = np.random.default_rng(seed) if policy == 'reservoir' else None
+
+    def cleared(self):
+        return evaluationRecorder(policy = self.policy, size = self.size, dtype = self.dtype, seed = self.seed)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def best(self):
+        """Latest stored result, which is the running best in 'improvements' mode."""
+        return self._res[self._count - 1] if self._count else np.inf
+
+    @property
+    def inputs(self):
+        """(n, dims) view of the stored inputs in insertion order. Only a
+        wrapped ring buffer has to be copied to restore that order."""
+        if self._inp is None:
+            return np.empty((0, 0), dtype = self.dtype)
+        if self.policy == 'ring' and self.seen > self.size:
+            return np.concatenate([self._inp[self._head:], self._inp[:self._head]])
+        return self._inp[:self._count]
+
+    @property
+    def results(self):
+        if self.policy == 'ring' and self.seen > self.size:
+            return np.concatenate([self._res[self._head:], self._res[:self._head]])
+        return self._res[:self._count]
+
+    def add(self, inputs, results):
+        """Offers a batch: `inputs` is (n, dims) and `results` is (n,)."""
+        inputs = np.asarray(inputs, dtype = self.dtype)
+        results = np.asarray(results, dtype = self.dtype)
+        if self._inp is None:
+            self._inp = np.empty((len(self._res), inputs.shape[1]), dtype = self.dtype)
+        if not len(results):
+            return
+
+        if self.policy == 'improvements':
+            keep = results < np.fmin.accumulate(np.append(self.best, results))[:-1]
+            if not self.seen:
+                keep[0] = True
+            self._append(inputs[keep], results[keep])
+        elif self.policy == 'full':
+            self._append(inputs, results)
+        elif self.policy == 'ring':
+            inputs, results = inputs[-self.size:], results[-self.size:]
+            slots = (self._head + np.arange(len(results))) % self.size
+            self._inp[slots] = inputs
+            self._res[slots] = results
+            self._head = (self._head + len(results)) % self.size
+            self._count = min(self._count + len(results), self.size)
+        else:
+            # Algorithm R, applied to the whole batch at once
+            order = self.seen + np.arange(len(results))
+            fill = order < self.size
+            self._inp[order[fill]] = inputs[fill]
+            self._res[order[fill]] = results[fill]
+            slots = self._rng.integers(0, order[~fill] + 1)
+            replace = slots < self.size
+            self._inp[slots[replace]] = inputs[~fill][replace]
+            self._res[slots[replace]] = results[~fill][replace]
+            self._count = min(self._count + len(results), self.size)
+
+        self.seen += len(results)
+
+    def _append(self, inputs, results):
+        size = self._count + len(results)
+        if size > len(self._res):
+            capacity = max(size, 2 * len(self._res), 1)
+            self._inp = np.concatenate([self._inp, np.empty((capacity - len(self._inp), self._inp.shape[1]), dtype = self.dtype)])
+            self._res = np.concatenate([self._res, np.empty(capacity - len(self._res), dtype = self.dtype)])
+        self._inp[self._count:size] = inputs
+        self._res[self._count:size] = results
+        self._count = size
+
 
 class Simulator:
-    def __init__(self, function):
+    def __init__(self, function, vectorized = False, pool = None, capacity = 1024, progress = None, progress_interval = 1.,
+                 record = 'full', record_size = None):
         self.f = function # actual objective function
+        self.vectorized = vectorized # f takes a (dims, popsize) array and returns popsize results
+        self.pool = pool # optional process pool used by `map`
+        self.progress = progress # optional sink (e.g. print or logger.info) for the per-iteration lines
+        self.progress_interval = progress_interval # minimum seconds between two progress lines
+        self._last_progress = None # time of the last progress line
         self.num_calls = 0 # how many times f has been called
         self.callback_count = 0 # number of times callback has been called, also measures iteration count
-        self.list_calls_inp = [] # input of all calls
-        self.list_calls_res = [] # result of all calls
-        self.decreasing_list_calls_inp = [] # input of calls that resulted in decrease
-        self.decreasing_list_calls_res = [] # result of calls that resulted in decrease
-        self.list_callback_inp = [] # only appends inputs on callback, as such they correspond to the iterations
-        self.list_callback_res = [] # only appends results on callback, as such they correspond to the iterations
+        self.calls = evaluationRecorder(policy = record, size = record_size, capacity = capacity) # all calls, or the subset kept by the policy
+        self.decreasing_calls = evaluationRecorder(policy = 'improvements', capacity = 64) # calls that resulted in decrease
+        self.callback_calls = evaluationRecorder(policy = 'full', capacity = 64) # only on callback, as such they correspond to the iterations
+
+    @property
+    def list_calls_inp(self):
+        return self.calls.inputs
+
+    @property
+    def list_calls_res(self):
+        return self.calls.results
+
+    @property
+    def decreasing_list_calls_inp(self):
+        return self.decreasing_calls.inputs
+
+    @property
+    def decreasing_list_calls_res(self):
+        return self.decreasing_calls.results
+
+    @property
+    def list_callback_inp(self):
+        return self.callback_calls.inputs
+
+    @property
+    def list_callback_res(self):
+        return self.callback_calls.results
+
+    def __getstate__(self):
+        """Only the objective travels when the wrapper is pickled, pools and
+        evaluation buffers stay in the parent process."""
+        state = self.__dict__.copy()
+        if 'f' in state:
+            state.update(
+                pool = None,
+                progress = None,
+                num_calls = 0,
+                calls = self.calls.cleared(),
+                decreasing_calls = self.decreasing_calls.cleared(),
+                callback_calls = self.callback_calls.cleared()
+            )
+        return state
 
     def simulate(self, x, *args):
         """Executes the actual simulation and returns the result, while
         updating the lists too. Pass to optimizer without arguments or
-        parentheses."""
+        parentheses. In vectorized mode x holds one population per column."""
         result = self.f(x, *args) # the actual evaluation of the function
-        if not self.num_calls: # first call is stored in all lists
-            self.decreasing_list_calls_inp.append(x)
-            self.decreasing_list_calls_res.append(result)
-            self.list_callback_inp.append(x)
-            self.list_callback_res.append(result)
-        elif result < self.decreasing_list_calls_res[-1]:
-            self.decreasing_list_calls_inp.append(x)
-            self.decreasing_list_calls_res.append(result)
-        self.list_calls_inp.append(x)
-        self.list_calls_res.append(result)
-        self.num_calls += 1
+        if self.vectorized:
+            self.record_batch(np.asarray(x).T, result)
+        else:
+            self.record(x, result)
         return result
 
+    def map(self, func, iterable):
+        """Map-like callable for the `workers` argument of scipy optimizers.
+        Evaluations run on `pool` (or serially without one) and are recorded
+        here, in the parent process."""
+        inputs = np.asarray(list(iterable), dtype = float)
+        mapper = map if self.pool is None else self.pool.map
+        results = np.asarray(list(mapper(func, inputs)), dtype = float)
+        self.record_batch(inputs, results)
+        return results
+
+    def record(self, x, result):
+        """Updates the lists with an evaluation done outside of `simulate`,
+        e.g. by an optimizer that prices many points at once."""
+        self.record_batch(np.atleast_1d(x)[np.newaxis, :], np.atleast_1d(result))
+
+    def record_batch(self, inputs, results):
+        """Records a whole population at once: `inputs` is (popsize, dims)
+        and `results` is (popsize,)."""
+        inputs = np.asarray(inputs, dtype = float)
+        results = np.asarray(results, dtype = float)
+
+        if not self.num_calls: # first call is stored in all lists
+            self.callback_calls.add(inputs[:1], results[:1])
+        self.decreasing_calls.add(inputs, results)
+        self.calls.add(inputs, results)
+        self.num_calls += len(results)
+
     def callback(self, xk, *_):
         """Callback function that can be used by optimizers of scipy.optimize.
         The third argument "*_" makes sure that it still works when the
         optimizer calls the callback function with more than one argument. Pass
         to optimizer without arguments or parentheses."""
-        s1 = ""
         xk = np.atleast_1d(xk)
-        # search backwards in input list for input corresponding to xk
-        for i, x in reversed(list(enumerate(self.list_calls_inp))):
-            x = np.atleast_1d(x)
-            if np.allclose(x, xk):
-                break
-        
-        for comp in xk:
-            s1 += f"{comp:10.5e}\t"
-        s1 += f"{self.list_calls_res[i]:10.5e}"
+        # the optimizer reports its best member, which is the best evaluation
+        # recorded so far; only re-evaluate if it hands back something else
+        if np.allclose(self.decreasing_list_calls_inp[-1], xk):
+            result = self.decreasing_calls.best
+        elif self.vectorized:
+            result = self.f(xk[:, np.newaxis])[0]
+        else:
+            result = self.f(xk)
 
-        self.list_callback_inp.append(xk)
-        self.list_callback_res.append(self.list_calls_res[i])
+        self.callback_calls.add(xk[np.newaxis, :], [result])
+        self._report(xk, result)
+        self.callback_count += 1
 
-        if not self.callback_count:
+    def _report(self, xk, result):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if self._last_progress is not None and now - self._last_progress < self.progress_interval:
+            return
+
+        if self._last_progress is None:
             s0 = ""
             for j, _ in enumerate(xk):
                 tmp = f"Comp-{j+1}"
                 s0 += f"{tmp:10s}\t"
             s0 += "Objective"
-            print(s0)
-        print(s1)
-        self.callback_count += 1
+            self.progress(s0)
+
+        s1 = ""
+        for comp in xk:
+            s1 += f"{comp:10.5e}\t"
+        s1 += f"{result:10.5e}"
+        self.progress(s1)
+        self._last_progress = now
@@ -0,0 +1,116 @@
+import json
+import numpy as np
+import os
+
+
+class costSurface:
+    """Cost surface Z over (mortgage_years x months_wait) with its improving
+    steps, in a compact form.
+
+    `dtype` picks the precision the values are kept in (float64 or float32)
+    and `storage` how: 'dense' keeps the whole grid, 'masked' keeps only the
+    feasible (finite) cells plus a packed bit mask, since the infeasible inf
+    region is usually most of the grid. `Z` rebuilds the dense grid on
+    demand. Surfaces save to a directory of .npy files; loading with
+    `mmap_mode` shares a dense surface between processes without copying."""
+    STORAGES = ('dense', 'masked')
+
+    def __init__(self, months_wait, mortgage_years, Z, steps = None, dtype = np.float64, storage = 'dense', params = None):
+        if storage not in costSurface.STORAGES:
+            raise ValueError(f"Unknown storage '{storage}', expected one of {costSurface.STORAGES}")
+        self.months_wait = months_wait
+        self.mortgage_years = mortgage_years
+        self.storage = storage
+        self.params = params
+        self.steps = np.empty((0, 4)) if steps is None else np.asarray(steps, dtype = float).reshape(-1, 4)
+
+        if storage == 'dense':
+            self.values = np.asarray(Z, dtype = dtype)
+            self.mask = None
+        else:
+            finite = np.isfinite(Z)
+            self.values = np.asarray(Z[finite], dtype = dtype)
+            self.mask = np.packbits(finite, axis = None)
+        self._rank = None
+
+    @property
+    def shape(self):
+        return (len(self.mortgage_years), len(self.months_wait))
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (0 if self.mask is None else self.mask.nbytes) \
+            + self.months_wait.nbytes + self.mortgage_years.nbytes + self.steps.nbytes
+
+    @property
+    def Z(self):
+        """Dense grid; a view (or the memory map itself) for dense storage."""
+        if self.storage == 'dense':
+            return self.values
+        Z = np.full(self.shape, np.inf, dtype = self.values.dtype)
+        Z[self.finite] = self.values
+        return Z
+
+    @property
+    def finite(self):
+        if self.mask is None:
+            return np.isfinite(self.values)
+        return np.unpackbits(self.mask, count = int(np.prod(self.shape))).reshape(self.shape).astype(bool)
+
+    def value(self, j, i):
+        """Z[j, i] as a float, without rebuilding the dense grid."""
+        if self.mask is None:
+            return float(self.values[j, i])
+        byte, bit = divmod(int(j) * len(self.months_wait) + int(i), 8)
+        packed = int(self.mask[byte])
+        if not packed >> (7 - bit) & 1:
+            return np.inf
+        if self._rank is None:
+            # finite cells before every byte of the mask
+            counts = np.unpackbits(self.mask).reshape(-1, 8).sum(axis = 1, dtype = np.int64)
+            self._rank = np.cumsum(counts) - counts
+        return float(self.values[self._rank[byte] + (packed >> (8 - bit)).bit_count()])
+
+    @property
+    def reducing_steps(self):
+        """Improving steps as (step, months, years, cost) tuples, as `cost_grid` returns them."""
+        return [(int(step), int(months), int(years), cost) for step, months, years, cost in self.steps.tolist()]
+
+    def as_tuple(self):
+        return (self.months_wait, self.mortgage_years, self.Z, self.reducing_steps)
+
+    def save(self, path):
+        """Writes the surface to the `path` directory."""
+        os.makedirs(path, exist_ok = True)
+        np.save(os.path.join(path, 'months_wait.npy'), self.months_wait)
+        np.save(os.path.join(path, 'mortgage_years.npy'), self.mortgage_years)
+        np.save(os.path.join(path, 'values.npy'), self.values)
+        np.save(os.path.join(path, 'steps.npy'), self.steps)
+        if self.mask is not None:
+            np.save(os.path.join(path, 'mask.npy'), self.mask)
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            # numpy scalars (e.g. np.int64 prices) are not JSON serializable
+            params = None if self.params is None else [value.item() if isinstance(value, np.generic) else value for value in self.params]
+            json.dump({'storage': self.storage, 'params': params}, file)
+
+    @classmethod
+    def load(cls, path, mmap_mode = None):
+        """Reads a saved surface; with `mmap_mode` ('r', 'c', ...) the arrays
+        are memory-mapped instead of read into memory."""
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+
+        surface = cls.__new__(cls)
+        surface.storage = meta['storage']
+        surface.params = None if meta['params'] is None else tuple(meta['params'])
+        surface.months_wait = np.load(os.path.join(path, 'months_wait.npy'))
+        surface.mortgage_years = np.load(os.path.join(path, 'mortgage_years.npy'))
+        surface.steps = np.load(os.path.join(path, 'steps.npy'))
+        surface.values = np.load(os.path.join(path, 'values.npy'), mmap_mode = mmap_mode)
+        surface.mask = np.load(os.path.join(path, 'mask.npy')) if surface.storage == 'masked' else None
+        surface._rank = None
+        return surface
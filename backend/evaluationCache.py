@@ -0,0 +1,134 @@
+from backend.instrumentation import TRACER
+from collections import OrderedDict
+import numpy as np
+
+
+class evaluationCache:
+    """Bounded LRU cache of objective values.
+
+    Points are keyed on the estimator parameters plus the rounded integer
+    (months to wait, mortgage years) pair. Whole cost surfaces are kept as
+    well, so a point or a sub-grid that was already priced by a grid pass is
+    served from the stored surface instead of being evaluated again. They
+    are stored as `costSurface`s, in the dtype and storage of the estimator
+    that priced them, and only served to lookups for the same dtype.
+
+    The cost components behind the surfaces are kept too, keyed on just the
+    parameters each one depends on, so an edit to one input only reprices the
+    components that use it."""
+
+    def __init__(self, maxsize = 65536, max_surfaces = 4, max_components = 32):
+        self.maxsize = maxsize
+        self.max_surfaces = max_surfaces
+        self.max_components = max_components
+        self.hits = 0
+        self.misses = 0
+        self._points = OrderedDict()
+        self._surfaces = OrderedDict()
+        self._components = OrderedDict()
+
+    def __getstate__(self):
+        # ship an empty cache to worker processes instead of the whole store
+        return {'maxsize': self.maxsize, 'max_surfaces': self.max_surfaces, 'max_components': self.max_components}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self._points)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'points': len(self._points),
+            'surfaces': len(self._surfaces),
+            'components': len(self._components)
+        }
+
+    def clear(self):
+        self._points.clear()
+        self._surfaces.clear()
+        self._components.clear()
+
+    def get(self, params_key, months, years, dtype = 'float64'):
+        """Cached value for one point, or None (counted as a miss); stored
+        surfaces are only read if they are kept in `dtype`."""
+        key = (params_key, months, years)
+        if key in self._points:
+            self._points.move_to_end(key)
+            self.hits += 1
+            TRACER.count('cache_hits')
+            return self._points[key]
+
+        for surface_key, surface in self._surfaces.items():
+            if surface_key[:2] != (params_key, np.dtype(dtype).str):
+                continue
+            months_wait, mortgage_years = surface.months_wait, surface.mortgage_years
+            i = np.searchsorted(months_wait, months)
+            j = np.searchsorted(mortgage_years, years)
+            if i < len(months_wait) and j < len(mortgage_years) and months_wait[i] == months and mortgage_years[j] == years:
+                self.hits += 1
+                TRACER.count('cache_hits')
+                return surface.value(j, i)
+
+        self.misses += 1
+        TRACER.count('cache_misses')
+        return None
+
+    def put(self, params_key, months, years, value):
+        if not self.maxsize:
+            return
+        self._points[(params_key, months, years)] = value
+        self._points.move_to_end((params_key, months, years))
+        while len(self._points) > self.maxsize:
+            self._points.popitem(last = False)
+
+    def get_surface(self, params_key, months_wait, mortgage_years, dtype = 'float64'):
+        """Z over (mortgage_years x months_wait) sliced out of a stored
+        surface kept in `dtype` covering both sorted axes, as float64, or None."""
+        for key, surface in self._surfaces.items():
+            if key[:2] != (params_key, np.dtype(dtype).str):
+                continue
+            stored_months, stored_years = surface.months_wait, surface.mortgage_years
+            i = np.searchsorted(stored_months, months_wait)
+            j = np.searchsorted(stored_years, mortgage_years)
+            if (i < len(stored_months)).all() and (j < len(stored_years)).all() \
+                    and (stored_months[i] == months_wait).all() and (stored_years[j] == mortgage_years).all():
+                self._surfaces.move_to_end(key)
+                self.hits += len(i) * len(j)
+                TRACER.count('cache_hits', len(i) * len(j))
+                return surface.Z[np.ix_(j, i)].astype(float, copy = False)
+
+        self.misses += len(months_wait) * len(mortgage_years)
+        TRACER.count('cache_misses', len(months_wait) * len(mortgage_years))
+        return None
+
+    def put_surface(self, params_key, surface):
+        if not self.max_surfaces:
+            return
+        key = (params_key, surface.dtype.str, surface.months_wait.tobytes(), surface.mortgage_years.tobytes())
+        self._surfaces[key] = surface
+        self._surfaces.move_to_end(key)
+        while len(self._surfaces) > self.max_surfaces:
+            self._surfaces.popitem(last = False)
+
+    def get_component(self, name, params, axes):
+        """Stored component `name` priced from `params` over the `axes` arrays, or None."""
+        key = (name, params) + tuple(axis.tobytes() for axis in axes)
+        if key in self._components:
+            self._components.move_to_end(key)
+            TRACER.count('component_hits')
+            return self._components[key]
+
+        TRACER.count('component_misses')
+        return None
+
+    def put_component(self, name, params, axes, value):
+        if not self.max_components:
+            return
+        key = (name, params) + tuple(axis.tobytes() for axis in axes)
+        self._components[key] = value
+        self._components.move_to_end(key)
+        while len(self._components) > self.max_components:
+            self._components.popitem(last = False)
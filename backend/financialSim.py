@@ -1,5 +1,21 @@
+from backend import jitKernels
 import numpy as np
-import pandas as pd
+
+
+class growthTable:
+    """Compounding factors (1 + rate)**n and annuity factors
+    rate * (1 + rate)**n / ((1 + rate)**n - 1) for n = 0 .. size - 1, built
+    once with a cumulative product so period lookups replace `**`."""
+
+    def __init__(self, rate, size):
+        self.rate = rate
+        self.factors = np.cumprod(np.append(1., np.full(size - 1, 1. + rate)))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            self.annuity = rate * self.factors / (self.factors - 1)
+
+    def __len__(self):
+        return len(self.factors)
+
 
 class financialFunctions:
     
@@ -14,6 +30,18 @@ class financialFunctions:
     def payments(principal, interest, periods = 30 * 12):
         return principal * (interest * (1 + interest)**periods) / ((1 + interest)**periods - 1) 
 
+    @staticmethod
+    def future_value_table(period, table, present_value = 0, payment = 0):
+        """`future_value` at the rate of a `growthTable`, reading the
+        compounding factors from it."""
+        growth = table.factors[period]
+        return present_value * growth + payment / table.rate * (growth - 1)
+
+    @staticmethod
+    def payments_table(principal, table, periods = 30 * 12):
+        """`payments` at the rate of a `growthTable`, reading the annuity factors from it."""
+        return principal * table.annuity[periods]
+
     @staticmethod
     def total_interest(principal, interest, periods):
         return financialFunctions.payments(principal, interest, periods) * periods - principal 
@@ -21,11 +49,46 @@ class financialFunctions:
     @staticmethod
     def principal_payments(current_period, initial_principal, interest, total_periods):
         payment = financialFunctions.payments(principal = initial_principal, interest = interest, periods = total_periods)
-        principal = initial_principal
-        for i in range(int(current_period)):
-            principal -= payment - principal * interest
-        return payment - principal * interest
-        
+        balance = financialFunctions.future_value(period = current_period, interest = interest, present_value = initial_principal, payment = -payment)
+        return payment - balance * interest
+
+    @staticmethod
+    def amortization_schedule(principal, interest, periods, n_periods = None, table = None):
+        """Closed-form amortization schedule for one or many loans.
+
+        `principal` and `periods` broadcast against each other; the schedule
+        is laid out on a trailing axis of length `n_periods` (defaults to the
+        longest term) and is zero after each loan is paid off. Returns the
+        payment plus, per period, the principal and interest paid, the
+        balance left after the payment and the cumulative interest. A
+        `growthTable` for `interest`, when given, replaces the powers."""
+        principal = np.asarray(principal, dtype = float)[..., np.newaxis]
+        periods = np.asarray(periods)[..., np.newaxis]
+        if n_periods is None:
+            n_periods = int(np.max(periods))
+        if table is not None and jitKernels.ENABLED:
+            return jitKernels.amortization_schedule(principal = principal[..., 0], periods = periods[..., 0], n_periods = n_periods, table = table)
+
+        steps = np.arange(n_periods)
+        if table is None:
+            payment = financialFunctions.payments(principal = principal, interest = interest, periods = periods)
+            opening_balance = financialFunctions.future_value(period = steps, interest = interest, present_value = principal, payment = -payment)
+        else:
+            payment = financialFunctions.payments_table(principal = principal, table = table, periods = periods)
+            opening_balance = financialFunctions.future_value_table(period = steps, table = table, present_value = principal, payment = -payment)
+
+        active = steps < periods
+        interest_paid = np.where(active, opening_balance * interest, 0.)
+        principal_paid = np.where(active, payment - interest_paid, 0.)
+        balance = np.where(active, opening_balance - principal_paid, 0.)
+
+        return {
+            'payment': payment[..., 0][()],
+            'principal': principal_paid,
+            'interest': interest_paid,
+            'balance': balance,
+            'cumulative_interest': np.cumsum(interest_paid, axis = -1)
+        }
 
     # @staticmethod
     # def remaining_principal_n_period(initial_principal, interest, current_period, total_periods):
@@ -43,12 +106,42 @@ class financialFunctions:
 
 
 
-from scipy.optimize import differential_evolution
 from backend.callBacksWrapper import Simulator
+from backend.evaluationCache import evaluationCache
+from backend.costSurface import costSurface
+from backend.monteCarlo import PATH_CHUNK, monte_carlo_surfaces
+from backend.instrumentation import TRACER, traced
 import numpy as np
+import math
+
+
+class searchResult(dict):
+    """Optimization result with attribute access, the fields of scipy's
+    `OptimizeResult` without importing scipy for the grid search."""
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
 
 class financialEstimator(Simulator, financialFunctions):
+    DEFAULT_BOUNDS = [(1, 40 * 12), (1, 30)] # (months to wait, mortgage years)
+
+    # constructor arguments kept under another attribute name
+    ARGUMENT_ATTRIBUTES = {'intallment_threshold': 'installment_threshold'}
+
+    # cost component -> estimator attributes it is priced from
+    COMPONENT_PARAMETERS = {
+        'future_house_value': ('house_price_growth', 'house_price'),
+        'future_saved_money': ('etf_growth', 'initial_etf_savings', 'savings_per_month'),
+        'total_rent_paid': ('rent_price_growth', 'rent_price'),
+        'mortgage_factors': ('monthly_mortgage_interes', 'schedule_key'),
+    }
+
     def __init__(self,
                 rent_price_growth,
                 rent_price,
@@ -58,7 +151,12 @@ class financialEstimator(Simulator, financialFunctions):
                 intallment_threshold,
                 savings_per_month,
                 etf_growth,
-                initial_etf_savings = 0
+                initial_etf_savings = 0,
+                optimizer = 'de',
+                cache = None,
+                surface_dtype = 'float64',
+                surface_storage = 'dense',
+                mortgage_schedule = None
                 ):
 
         self.rent_price_growth = rent_price_growth
@@ -70,140 +168,681 @@ class financialEstimator(Simulator, financialFunctions):
         self.savings_per_month = savings_per_month
         self.etf_growth = etf_growth
         self.initial_etf_savings = initial_etf_savings
-        self.__bounds =  [(1, 40 * 12), (1, 30)]
+        self.optimizer = optimizer
+        self.cache = evaluationCache() if cache is None else cache
+        self.surface_dtype = surface_dtype
+        self.surface_storage = surface_storage
+        self.mortgage_schedule = mortgage_schedule # rateSchedule replacing the flat mortgage rate, if any
+        self.grid_surface = None
+        self.__tables = {} # rate attribute -> growthTable
+        self.__bounds =  list(financialEstimator.DEFAULT_BOUNDS)
 
     @property
     def bounds(self):
         return self.__bounds
 
+    @property
+    def init_kwargs(self):
+        """Arguments that rebuild an estimator with the same inputs."""
+        return {
+            'rent_price_growth': self.rent_price_growth,
+            'rent_price': self.rent_price,
+            'house_price_growth': self.house_price_growth,
+            'house_price': self.house_price,
+            'monthly_mortgage_interes': self.monthly_mortgage_interes,
+            'intallment_threshold': self.installment_threshold,
+            'savings_per_month': self.savings_per_month,
+            'etf_growth': self.etf_growth,
+            'initial_etf_savings': self.initial_etf_savings,
+            'optimizer': self.optimizer,
+            'surface_dtype': self.surface_dtype,
+            'surface_storage': self.surface_storage,
+            'mortgage_schedule': self.mortgage_schedule
+        }
+
+    @property
+    def schedule_key(self):
+        return None if self.mortgage_schedule is None else self.mortgage_schedule.key
+
+    @property
+    def params_key(self):
+        return (
+            self.rent_price_growth,
+            self.rent_price,
+            self.house_price_growth,
+            self.house_price,
+            self.monthly_mortgage_interes,
+            self.installment_threshold,
+            self.savings_per_month,
+            self.etf_growth,
+            self.initial_etf_savings,
+            self.schedule_key
+        )
+
         
     def objective_function(self, x):
+        # DE's polish steps to nan when no point around it is feasible (inf - inf gradients)
+        if not (math.isfinite(x[0]) and math.isfinite(x[1])):
+            return np.inf
+        params_key = self.params_key
+        months, years = int(np.round(x[0])), int(np.round(x[1]))
+
+        result = self.cache.get(params_key, months, years, self.surface_dtype)
+        if result is None:
+            if jitKernels.ENABLED and self.mortgage_schedule is None:
+                result = self.kernel_point(months, years)
+                TRACER.count('cells_priced')
+            else:
+                result = float(self.batch_objective(months_wait = months, mortgage_years = years))
+            self.cache.put(params_key, months, years, result)
+        return result
+
+
+    def population_objective(self, x):
+        """Batched objective for scipy's `vectorized = True`: x is (2, popsize).
+        Only the points missing from the cache are priced, non-finite ones are inf."""
+        params_key = self.params_key
+        x = np.asarray(x, dtype = float)
+        finite = np.isfinite(x[0]) & np.isfinite(x[1])
+        months, years = np.round(x[0][finite]).astype(int), np.round(x[1][finite]).astype(int)
+
+        priced = np.array([self.cache.get(params_key, m, y, self.surface_dtype) for m, y in zip(months.tolist(), years.tolist())], dtype = float)
+        missing = np.isnan(priced)
+        if missing.any():
+            priced[missing] = self.batch_objective(months_wait = months[missing], mortgage_years = years[missing])
+            for m, y, value in zip(months[missing].tolist(), years[missing].tolist(), priced[missing].tolist()):
+                self.cache.put(params_key, m, y, value)
+
+        results = np.full(finite.shape, np.inf)
+        results[finite] = priced
+        return results
+
+
+    def surface(self, months_wait, mortgage_years):
+        """Cost surface Z over (mortgage_years x months_wait), served from the
+        cache when a stored surface in `surface_dtype` already covers both
+        axes. Z holds the values as stored, rounded to `surface_dtype`, so it
+        does not depend on whether the cache was warm."""
+        params_key = self.params_key
+        Z = self.cache.get_surface(params_key, months_wait, mortgage_years, self.surface_dtype)
+        if Z is None:
+            components = self.decomposed_components(months_wait, mortgage_years)
+            Z = financialEstimator.masked_cost(components, self.installment_threshold)
+            TRACER.count('cells_priced', Z.size)
+            surface = self.compact_surface(months_wait, mortgage_years, Z)
+            self.cache.put_surface(params_key, surface)
+            if surface.dtype != Z.dtype:
+                Z = Z.astype(surface.dtype).astype(float)
+        return Z
+
+
+    def compact_surface(self, months_wait, mortgage_years, Z, steps = None):
+        """`costSurface` of Z in `surface_dtype` and `surface_storage`."""
+        return costSurface(
+                    months_wait = months_wait,
+                    mortgage_years = mortgage_years,
+                    Z = Z,
+                    steps = steps,
+                    dtype = self.surface_dtype,
+                    storage = self.surface_storage,
+                    params = self.params_key
+                    )
 
-        x_0 = np.round(x[0]).astype(int) # Months to wait
-        x_1 = np.round(x[1]).astype(int) # Mortgage years
 
-        future_house_val = financialFunctions.future_value(
+    def component(self, name, axes, compute):
+        """Cached cost component over `axes`, keyed only on the parameters in
+        COMPONENT_PARAMETERS[name]; `compute` prices it on a miss."""
+        params = tuple(getattr(self, attribute) for attribute in financialEstimator.COMPONENT_PARAMETERS[name])
+        value = self.cache.get_component(name, params, axes)
+        if value is None:
+            value = compute()
+            self.cache.put_component(name, params, axes, value)
+        return value
+
+
+    def month_components(self, months_wait):
+        """Cached (1 x months) vectors of the future house value, future
+        savings and rent paid for every month to wait."""
+        x_0 = np.round(months_wait).astype(int)[np.newaxis, :]
+
+        future_house_val = self.component('future_house_value', (months_wait,), lambda: financialFunctions.future_value_table(
                                                     period = x_0, 
-                                                    interest = self.house_price_growth, 
+                                                    table = self.growth_table('house_price_growth', x_0), 
                                                     present_value = self.house_price, 
                                                     payment = 0
-                                                    )
-        future_saved_money = financialFunctions.future_value(
+                                                    ))
+        future_saved_money = self.component('future_saved_money', (months_wait,), lambda: financialFunctions.future_value_table(
                                                     period = x_0, 
-                                                    interest = self.etf_growth, 
+                                                    table = self.growth_table('etf_growth', x_0), 
                                                     present_value = self.initial_etf_savings, 
                                                     payment = self.savings_per_month
+                                                    ))
+        total_rent_paid = self.component('total_rent_paid', (months_wait,), lambda: financialFunctions.future_value_table(
+                                                    period = x_0, 
+                                                    table = self.growth_table('rent_price_growth', x_0), 
+                                                    present_value = 0, 
+                                                    payment = self.rent_price
+                                                    ))
+        return future_house_val, future_saved_money, total_rent_paid
+
+
+    def decomposed_components(self, months_wait, mortgage_years):
+        """`cost_components` over the (mortgage_years x months_wait) grid,
+        assembled from separately cached pieces. After an edit only the pieces
+        depending on the edited input are priced again: a rent edit reprices
+        one vector over the months and a threshold edit nothing at all. Only
+        vectors are kept, the grids are multiplied out of them on every call."""
+        x_1 = np.round(mortgage_years).astype(int)[:, np.newaxis]
+        future_house_val, future_saved_money, total_rent_paid = self.month_components(months_wait)
+
+        # only the per-term factors are kept, the grids take a multiplication to rebuild
+        factors = self.component('mortgage_factors', (mortgage_years,), lambda: self.mortgage_factors(x_1))
+        principal = future_house_val - future_saved_money
+        monthly_payments = self.installments(principal, x_1, factors)
+        mortgage_interest = self.mortgage_interest(principal, monthly_payments, x_1, factors)
+
+        return {
+            'house_appreciation_cost': future_house_val - self.house_price,
+            'total_rent_paid': total_rent_paid,
+            'mortgage_interest': mortgage_interest,
+            'monthly_payments': monthly_payments,
+            'savings_exceed_price': future_saved_money > future_house_val
+        }
+
+
+    def batch_objective(self, months_wait, mortgage_years):
+        """Cost for arrays of waiting months and mortgage years.
+
+        Inputs are rounded to integers and broadcast against each other, so
+        `months_wait[np.newaxis, :]` and `mortgage_years[:, np.newaxis]` give
+        the whole (years x months) surface in a single pass. Points where the
+        installment goes over the threshold or the savings exceed the house
+        value are masked as infeasible (inf). Priced by the compiled kernel
+        when `jitKernels` is enabled and the mortgage rate is flat."""
+        if jitKernels.ENABLED and self.mortgage_schedule is None:
+            cost = self.kernel_objective(months_wait, mortgage_years)
+        else:
+            components = self.cost_components(months_wait = months_wait, mortgage_years = mortgage_years)
+            cost = financialEstimator.masked_cost(components, self.installment_threshold)
+        TRACER.count('cells_priced', np.size(cost))
+        return cost
+
+
+    def kernel_objective(self, months_wait, mortgage_years):
+        x_0 = np.round(months_wait).astype(int)
+        x_1 = np.round(mortgage_years).astype(int)
+        return jitKernels.objective(
+                    months = x_0,
+                    years = x_1,
+                    house_price = self.house_price,
+                    house_table = self.growth_table('house_price_growth', x_0),
+                    initial_savings = self.initial_etf_savings,
+                    savings_per_month = self.savings_per_month,
+                    etf_table = self.growth_table('etf_growth', x_0),
+                    rent_price = self.rent_price,
+                    rent_table = self.growth_table('rent_price_growth', x_0),
+                    mortgage_table = self.growth_table('monthly_mortgage_interes', x_1 * 12),
+                    threshold = self.installment_threshold
+                    )
+
+
+    def kernel_point(self, months, years):
+        """`kernel_objective` for one integer point, without any array handling."""
+        house_table = self.growth_table('house_price_growth', months)
+        etf_table = self.growth_table('etf_growth', months)
+        rent_table = self.growth_table('rent_price_growth', months)
+        return jitKernels.objective_point(
+                    months, years, 
+                    float(self.house_price), house_table.factors,
+                    float(self.initial_etf_savings), float(self.savings_per_month), float(etf_table.rate), etf_table.factors,
+                    float(self.rent_price), float(rent_table.rate), rent_table.factors,
+                    self.growth_table('monthly_mortgage_interes', years * 12).annuity, float(self.installment_threshold)
+                    )
+
+
+    def mortgage_factors(self, mortgage_years):
+        """Per unit of principal, for terms of `mortgage_years`: the installment
+        and the total paid over the term, the latter None at the flat mortgage
+        rate, where `mortgage_interest` works from the installments."""
+        periods = mortgage_years * 12
+        if self.mortgage_schedule is None:
+            return self.growth_table('monthly_mortgage_interes', periods).annuity[periods], None
+        return self.mortgage_schedule.loan_factors(periods)
+
+
+    def installments(self, principal, mortgage_years, factors = None):
+        """Monthly installment checked against the threshold: the payment at
+        the flat mortgage rate or, with a `mortgage_schedule`, the largest
+        payment over its refixes. `factors` are `mortgage_factors` priced already."""
+        factors = self.mortgage_factors(mortgage_years) if factors is None else factors
+        return principal * factors[0]
+
+
+    def mortgage_interest(self, principal, monthly_payments, mortgage_years, factors = None):
+        """Interest paid over the whole term, for the `installments` of `principal`."""
+        if self.mortgage_schedule is None:
+            # in place, to keep the grid-sized temporaries down to one
+            interest = monthly_payments * mortgage_years
+            interest *= 12
+            interest -= principal
+            return interest
+        factors = self.mortgage_factors(mortgage_years) if factors is None else factors
+        return principal * (factors[1] - 1)
+
+
+    def amortization(self, principal, periods, n_periods = None):
+        """`amortization_schedule` at the flat mortgage rate or under the `mortgage_schedule`."""
+        if self.mortgage_schedule is not None:
+            return self.mortgage_schedule.amortization_schedule(principal = principal, periods = periods, n_periods = n_periods)
+        return financialFunctions.amortization_schedule(
+                                principal = principal, 
+                                interest = self.monthly_mortgage_interes, 
+                                periods = periods,
+                                n_periods = n_periods,
+                                table = self.growth_table('monthly_mortgage_interes', max(int(np.max(periods)), n_periods or 0))
+                                )
+
+
+    def growth_table(self, rate, periods):
+        """`growthTable` of the estimator attribute `rate` (e.g.
+        'house_price_growth') covering every period in `periods`. Tables are
+        kept per estimator and only rebuilt, larger or for a new rate, when
+        they do not cover the request."""
+        size = (periods if isinstance(periods, int) else int(np.max(periods))) + 1
+        table = self.__tables.get(rate)
+        if table is None or table.rate != getattr(self, rate) or len(table) < size:
+            table = growthTable(getattr(self, rate), 1 << max(size - 1, 1023).bit_length())
+            self.__tables[rate] = table
+        return table
+
+
+    def cost_components(self, months_wait, mortgage_years):
+        """Unmasked pieces of the objective, priced from the growth tables
+        (`parametric_components` computes the same with powers). Nothing here
+        depends on the installment threshold, which only enters through
+        `masked_cost`."""
+        x_0 = np.round(months_wait).astype(int) # Months to wait
+        x_1 = np.round(mortgage_years).astype(int) # Mortgage years
+
+        future_house_val = financialFunctions.future_value_table(
+                                                    period = x_0, 
+                                                    table = self.growth_table('house_price_growth', x_0), 
+                                                    present_value = self.house_price, 
+                                                    payment = 0
                                                     )
-        mortgage_interest = financialFunctions.total_interest(
-                                                    principal = future_house_val - future_saved_money, 
-                                                    interest = self.monthly_mortgage_interes, 
-                                                    periods = x_1 * 12
+        future_saved_money = financialFunctions.future_value_table(
+                                                    period = x_0, 
+                                                    table = self.growth_table('etf_growth', x_0), 
+                                                    present_value = self.initial_etf_savings, 
+                                                    payment = self.savings_per_month
                                                     )
-        total_rent_paid = financialFunctions.future_value(
+        monthly_payments = self.installments(
+                                                principal = future_house_val - future_saved_money, 
+                                                mortgage_years = x_1
+                                                )
+        total_rent_paid = financialFunctions.future_value_table(
                                                     period = x_0, 
-                                                    interest = self.rent_price_growth, 
+                                                    table = self.growth_table('rent_price_growth', x_0), 
                                                     present_value = 0, 
                                                     payment = self.rent_price
                                                     )
-        
-        house_appreciation_cost = future_house_val - self.house_price
-        
 
+        return {
+            'house_appreciation_cost': future_house_val - self.house_price,
+            'total_rent_paid': total_rent_paid,
+            'mortgage_interest': self.mortgage_interest(future_house_val - future_saved_money, monthly_payments, x_1),
+            'monthly_payments': monthly_payments,
+            'savings_exceed_price': future_saved_money > future_house_val
+        }
+
+
+    @staticmethod
+    def parametric_components(months_wait, mortgage_years, rent_price_growth, rent_price, house_price_growth, house_price,
+                              monthly_mortgage_interes, savings_per_month, etf_growth, initial_etf_savings = 0):
+        """`cost_components` with the parameters as arguments. Parameters may
+        be arrays too, so a (params x years x months) tensor prices many
+        parameter sets in one broadcast pass."""
+
+        x_0 = np.round(months_wait).astype(int) # Months to wait
+        x_1 = np.round(mortgage_years).astype(int) # Mortgage years
+
+        future_house_val = financialFunctions.future_value(
+                                                    period = x_0, 
+                                                    interest = house_price_growth, 
+                                                    present_value = house_price, 
+                                                    payment = 0
+                                                    )
+        future_saved_money = financialFunctions.future_value(
+                                                    period = x_0, 
+                                                    interest = etf_growth, 
+                                                    present_value = initial_etf_savings, 
+                                                    payment = savings_per_month
+                                                    )
         monthly_payments = financialFunctions.payments(
                                                 principal = future_house_val - future_saved_money, 
-                                                interest = self.monthly_mortgage_interes, 
+                                                interest = monthly_mortgage_interes, 
                                                 periods = x_1 * 12
                                                 )
+        total_rent_paid = financialFunctions.future_value(
+                                                    period = x_0, 
+                                                    interest = rent_price_growth, 
+                                                    present_value = 0, 
+                                                    payment = rent_price
+                                                    )
 
-        if monthly_payments > self.installment_threshold:
-            # print('Monthly payment too high: ', monthly_payments)
-            return np.inf
-        
-        if future_saved_money > future_house_val:
-            return np.inf
+        return {
+            'house_appreciation_cost': future_house_val - house_price,
+            'total_rent_paid': total_rent_paid,
+            'mortgage_interest': monthly_payments * x_1 * 12 - (future_house_val - future_saved_money),
+            'monthly_payments': monthly_payments,
+            'savings_exceed_price': future_saved_money > future_house_val
+        }
 
-        # print('At step: ',x_0, x_1 ,'house val: ', future_house_val, ', saved mon: ', future_saved_money, ', tot int: ', mortgage_interest, ', tot_rent: ', total_rent_paid, ', paym: ', monthly_payments)
-        
-        return mortgage_interest + total_rent_paid + house_appreciation_cost
 
+    @staticmethod
+    def masked_cost(components, installment_threshold):
+        infeasible = (components['monthly_payments'] > installment_threshold) | components['savings_exceed_price']
+        cost = components['mortgage_interest'] + components['total_rent_paid'] + components['house_appreciation_cost']
+        return np.where(infeasible, np.inf, cost)
 
-    def cost_grid(self):
 
-        # Generate data for the heatmap (example: 2D Gaussian function)
-        months_wait = np.arange(self.bounds[0][0], self.bounds[0][1], dtype= int)
-        mortgage_years = np.arange(self.bounds[1][0], self.bounds[1][1], dtype= int)
+    @traced('threshold_surfaces')
+    def threshold_surfaces(self, thresholds, months_wait, mortgage_years):
+        """One cost surface per installment threshold. The components are
+        priced once and only the feasibility mask changes between them."""
+        components = self.decomposed_components(months_wait, mortgage_years)
+        return [financialEstimator.masked_cost(components, threshold) for threshold in thresholds]
 
-        Z = np.zeros(shape = (len(mortgage_years), len(months_wait)))    
-        
-        reducing_steps = []
-        mini = np.inf
-        # INSTALLMENT_THRESH = 5000
-        step = 1
 
-        for i, months in enumerate(months_wait):
-            for j, mortgage in enumerate(mortgage_years):
-                Z[j, i] = self.objective_function([months , mortgage])
-                if Z[j, i] < mini:
-                    # print(months, mortgage, Z[j, i])
-                    mini = Z[j, i]
-                    reducing_steps.append((step, months, mortgage, Z[j, i]))
-                    step += 1
+    @staticmethod
+    def reducing_path(months_wait, mortgage_years, Z):
+        """Strictly improving running minimum of Z, in the order of a scan
+        over months (outer) and mortgage years (inner)."""
+        flat = Z.T.ravel()
+        running_min = np.append(np.inf, np.fmin.accumulate(flat)[:-1])
+        improved = np.flatnonzero(flat < running_min)
+
+        return list(zip(
+                    range(1, len(improved) + 1),
+                    months_wait[improved // len(mortgage_years)].tolist(),
+                    mortgage_years[improved % len(mortgage_years)].tolist(),
+                    flat[improved].tolist()
+                    ))
+
+
+    def cost_grid(self, months_wait = None, mortgage_years = None):
+        return self.cost_surface(months_wait, mortgage_years).as_tuple()
+
+
+    @traced('cost_grid')
+    def cost_surface(self, months_wait = None, mortgage_years = None):
+        """Cost grid as a `costSurface` in `surface_dtype` and `surface_storage`,
+        kept as `grid_surface`; the improving steps are taken on the `surface` values."""
+        if months_wait is None:
+            months_wait = np.arange(self.bounds[0][0], self.bounds[0][1], dtype= int)
+        if mortgage_years is None:
+            mortgage_years = np.arange(self.bounds[1][0], self.bounds[1][1], dtype= int)
+
+        Z = self.surface(months_wait, mortgage_years)
+        reducing_steps = financialEstimator.reducing_path(months_wait, mortgage_years, Z)
+
+        self.grid_surface = self.compact_surface(months_wait, mortgage_years, Z, steps = reducing_steps)
+        # the cache shares it instead of keeping a copy of its own
+        self.cache.put_surface(self.params_key, self.grid_surface)
+        return self.grid_surface
+
+    @property
+    def months_wait(self):
+        return None if self.grid_surface is None else self.grid_surface.months_wait
 
-        self.months_wait = months_wait
-        self.mortgage_years = mortgage_years
-        self.Z = Z
-        self.reducing_steps = reducing_steps
+    @property
+    def mortgage_years(self):
+        return None if self.grid_surface is None else self.grid_surface.mortgage_years
 
-        return (months_wait, mortgage_years, Z, reducing_steps)
+    @property
+    def Z(self):
+        return None if self.grid_surface is None else self.grid_surface.Z
 
+    @property
+    def reducing_steps(self):
+        return None if self.grid_surface is None else self.grid_surface.reducing_steps
+
+
+    def save_surface(self, path):
+        """Prices the cost surface over every integer point of `bounds` and
+        saves it to the `path` directory for `load_surface`."""
+        months_wait, mortgage_years = self.search_axes()
+        Z = self.surface(months_wait, mortgage_years)
+        surface = self.compact_surface(months_wait, mortgage_years, Z, steps = financialEstimator.reducing_path(months_wait, mortgage_years, Z))
+        surface.save(path)
+        return surface
+
+    def load_surface(self, path, mmap_mode = 'r'):
+        """Seeds the evaluation cache with a surface saved for the same
+        parameters and `surface_dtype`. Memory-mapped dense surfaces are
+        served without a copy, so worker processes loading the same file
+        share its pages."""
+        surface = costSurface.load(path, mmap_mode = mmap_mode)
+        if surface.params != self.params_key:
+            raise ValueError(f"Surface at '{path}' was priced for other parameters")
+        if surface.dtype != np.dtype(self.surface_dtype):
+            raise ValueError(f"Surface at '{path}' is kept in {surface.dtype}, expected {np.dtype(self.surface_dtype)}")
+        self.cache.put_surface(self.params_key, surface)
+        return surface
+
+
+    @traced('run_simulation')
+    def run_simulation(self, optimizer = None, vectorized = False, workers = 1, progress = None, progress_interval = 1., record = 'full', record_size = None, prune = True):
+        """Minimizes the objective over `bounds`. With the DE optimizer,
+        `vectorized` prices each population in one batch_objective call,
+        `workers` > 1 fans evaluations out over a process pool and
+        `progress` (e.g. print) receives an iteration line at most every
+        `progress_interval` seconds. `record` and `record_size` pick the
+        Simulator recording policy for all calls.
+
+        With `prune` both optimizers only search the `feasible_bounds` box,
+        and DE starts from the best point on the feasibility boundary."""
+        optimizer = self.optimizer if optimizer is None else optimizer
+
+        if optimizer == 'grid':
+            return self.grid_search(prune = prune)
+        elif optimizer != 'de':
+            raise ValueError(f"Unknown optimizer '{optimizer}', expected 'de' or 'grid'")
+        # scipy takes about half a second to import, only pay for it when DE runs
+        from scipy.optimize import differential_evolution
+
+        bounds, x0 = self.bounds, None
+        feasible = self.feasible_bounds() if prune else None
+        if feasible is not None:
+            # half a step past the box, so every integer in it rounds in with the same weight
+            bounds = [(max(low - 0.5, full[0]), min(high + 0.5, full[1])) for (low, high), full in zip(feasible, self.bounds)]
+            x0 = self.warm_start(feasible)
+
+        if vectorized:
+            wrapper = Simulator(self.population_objective, vectorized = True, progress = progress, progress_interval = progress_interval, record = record, record_size = record_size)
+
+            result = differential_evolution(
+                        func = wrapper.simulate, 
+                        bounds = bounds, 
+                        x0 = x0,
+                        callback = wrapper.callback,
+                        vectorized = True,
+                        updating = 'deferred'
+                        )
+
+        elif workers != 1:
+            with jitKernels.pool_context().Pool(None if workers == -1 else workers) as pool:
+                wrapper = Simulator(self.objective_function, pool = pool, progress = progress, progress_interval = progress_interval, record = record, record_size = record_size)
+
+                result = differential_evolution(
+                            func = self.objective_function, 
+                            bounds = bounds, 
+                            x0 = x0,
+                            callback = wrapper.callback,
+                            workers = wrapper.map,
+                            updating = 'deferred'
+                            )
+            wrapper.pool = None
+
+        else:
+            wrapper = Simulator(self.objective_function, progress = progress, progress_interval = progress_interval, record = record, record_size = record_size)
+
+            result = differential_evolution(
+                        func = wrapper.simulate, 
+                        bounds = bounds, 
+                        x0 = x0,
+                        callback = wrapper.callback
+                        )
+
+        TRACER.count('objective_evaluations', wrapper.num_calls)
+        return result, wrapper
 
-    def run_simulation(self):
-        
-        wrapper = Simulator(self.objective_function)
 
-        result = differential_evolution(
-                    func = wrapper.simulate, 
-                    bounds = self.bounds, 
-                    callback = wrapper.callback
+    def search_axes(self):
+        """Every integer point of `bounds`, both ends included."""
+        return (
+            np.arange(self.bounds[0][0], self.bounds[0][1] + 1, dtype = int),
+            np.arange(self.bounds[1][0], self.bounds[1][1] + 1, dtype = int)
+        )
+
+
+    def feasible_bounds(self):
+        """Smallest [(months lo, hi), (years lo, hi)] box holding every
+        feasible integer point of `bounds`, or None when there is none.
+
+        Feasibility is 0 <= principal(months) and payment(principal, years)
+        <= threshold. The payment falls with the term, so the feasible months
+        are those of the longest term and the shortest feasible term is the
+        one that fits the smallest principal: both come from vectors over one
+        axis instead of the whole surface."""
+        months_wait, mortgage_years = self.search_axes()
+        future_house_val, future_saved_money, _ = self.month_components(months_wait)
+        principal = (future_house_val - future_saved_money)[0]
+
+        # installment per unit of principal; at a flat rate the longest term has the smallest
+        unit_installments = self.installments(principal = 1., mortgage_years = mortgage_years)
+        months_ok = (principal >= 0) & (principal * unit_installments.min() <= self.installment_threshold)
+        if not months_ok.any():
+            return None
+
+        smallest_principal = principal[months_ok].min()
+        years_ok = smallest_principal * unit_installments <= self.installment_threshold
+
+        i, j = np.flatnonzero(months_ok), np.flatnonzero(years_ok)
+        return [(int(months_wait[i[0]]), int(months_wait[i[-1]])), (int(mortgage_years[j[0]]), int(mortgage_years[j[-1]]))]
+
+
+    def warm_start(self, feasible):
+        """Cheapest point on the feasibility boundary: for every term in the
+        `feasible` box, the first month whose principal fits the threshold
+        (bisected on the running minimum of the principal)."""
+        months_wait, _ = self.search_axes()
+        future_house_val, future_saved_money, _ = self.month_components(months_wait)
+        principal = (future_house_val - future_saved_money)[0]
+
+        years = np.arange(feasible[1][0], feasible[1][1] + 1, dtype = int)
+        max_principal = self.installment_threshold / self.installments(principal = 1., mortgage_years = years)
+        first = np.searchsorted(-np.fmin.accumulate(principal), -max_principal)
+        months = np.clip(months_wait[np.minimum(first, len(months_wait) - 1)], feasible[0][0], feasible[0][1])
+
+        costs = self.population_objective(np.vstack([months, years]))
+        best = np.argmin(costs)
+        return np.array([months[best], years[best]], dtype = float)
+
+
+    @traced('monte_carlo')
+    def monte_carlo(self, models, paths = 10000, percentiles = (5, 50, 95), seed = None, workers = 1, path_chunk = PATH_CHUNK):
+        """Cost surfaces over every integer point of `bounds` when the rates
+        in `models` ({attribute: rateModel}) follow `paths` simulated paths;
+        the mortgage rate is locked at the rate of the purchase month.
+
+        Paths are simulated `path_chunk` at a time, spread over `workers`
+        processes (None = one per core), so memory does not grow with
+        `paths`. Over several chunks the percentiles are read from per-cell
+        histograms merged over the chunks, within a bin width of the exact
+        ones. Returns a dict with the axes, a (years x months) surface per
+        entry of `percentiles`, the probability of every cell being feasible
+        and of it being the path's optimum, the number of paths and the seed.
+        A `mortgage_schedule` is not applied here."""
+        months_wait, mortgage_years = self.search_axes()
+        return monte_carlo_surfaces(
+                    params = self.init_kwargs,
+                    months_wait = months_wait,
+                    mortgage_years = mortgage_years,
+                    models = models,
+                    paths = paths,
+                    percentiles = percentiles,
+                    seed = seed,
+                    workers = workers,
+                    path_chunk = path_chunk
+                    )
+
+
+    @traced('grid_search')
+    def grid_search(self, prune = True):
+        """Exact optimizer: argmin of the cost surface over every integer point
+        in `bounds` (in the `feasible_bounds` box with `prune`, which gives the
+        same optimum and improving steps, since every point outside of it is
+        infeasible). Returns the same (result, wrapper) pair as the DE path,
+        with the improving steps of the scan recorded on the wrapper."""
+        months_wait, mortgage_years = self.search_axes()
+        feasible = self.feasible_bounds() if prune else None
+        if feasible is not None:
+            months_wait = months_wait[(months_wait >= feasible[0][0]) & (months_wait <= feasible[0][1])]
+            mortgage_years = mortgage_years[(mortgage_years >= feasible[1][0]) & (mortgage_years <= feasible[1][1])]
+        Z = self.surface(months_wait, mortgage_years)
+        TRACER.count('objective_evaluations', Z.size)
+
+        wrapper = Simulator(self.objective_function)
+        steps = np.array(financialEstimator.reducing_path(months_wait, mortgage_years, Z), dtype = float).reshape(-1, 4)
+        wrapper.record_batch(steps[:, 1:3], steps[:, 3])
+
+        j, i = np.unravel_index(np.argmin(Z), Z.shape)
+        fun = float(Z[j, i])
+        if np.dtype(self.surface_dtype) != np.float64 and np.isfinite(fun):
+            # Z is rounded to surface_dtype, the optimum is reported at full precision
+            fun = float(self.batch_objective(months_wait[i], mortgage_years[j]))
+        result = searchResult(
+                    x = np.array([months_wait[i], mortgage_years[j]], dtype = float),
+                    fun = fun,
+                    nfev = Z.size,
+                    nit = 1,
+                    success = bool(np.isfinite(Z[j, i])),
+                    message = 'Exhaustive search over the integer grid' if np.isfinite(Z[j, i]) else 'No feasible point in the grid'
                     )
 
         return result, wrapper
     
 
+    @traced('calculate_scenarios')
     def calculate_scenarios(self, opt_results_obj, sub_optimal_df):
+        import pandas as pd
         months = int(np.round(opt_results_obj.x[0]))
         mortgage_years = int(np.round(opt_results_obj.x[1]))
 
         total_periods = np.arange(0, months + (mortgage_years + 30) * 12, dtype = int)
-        mortgage_periods = np.arange(0, mortgage_years * 12, dtype = int)
-        rent_prices = np.apply_along_axis(financialEstimator.future_value, 0, total_periods, payment = self.rent_price, interest = self.rent_price_growth)
-
-        house_prices = np.apply_along_axis(financialEstimator.future_value, 0, total_periods, present_value = self.house_price, interest = self.house_price_growth)
-        saved_amounts = np.apply_along_axis(financialEstimator.future_value, 0, total_periods, present_value = self.initial_etf_savings, interest = self.etf_growth, payment = self.savings_per_month)
+        sub_total_periods = np.arange(0, sub_optimal_df['months_to_wait'].max() + 30 * 12 + 1, dtype = int)
 
-        # print(saved_amounts)
+        # every series is priced once over the longest horizon and sliced
+        periods = total_periods if len(total_periods) >= len(sub_total_periods) else sub_total_periods
+        rent_series = financialFunctions.future_value_table(period = periods, table = self.growth_table('rent_price_growth', periods), payment = self.rent_price)
+        house_series = financialFunctions.future_value_table(period = periods, table = self.growth_table('house_price_growth', periods), present_value = self.house_price)
+        saved_series = financialFunctions.future_value_table(period = periods, table = self.growth_table('etf_growth', periods), present_value = self.initial_etf_savings, payment = self.savings_per_month)
 
+        rent_prices = rent_series[:len(total_periods)]
+        house_prices = house_series[:len(total_periods)]
+        saved_amounts = saved_series[:len(total_periods)]
 
         house_appreciation_cost = house_prices - self.house_price
-        # INITIAL_ETF_SAVINGS
 
 
-
-        principal_payments = [
-                                financialEstimator.principal_payments(
-                                            current_period = int(i), 
-                                            initial_principal = house_prices[months] - saved_amounts[months], 
-                                            interest = self.monthly_mortgage_interes, 
-                                            total_periods = mortgage_years * 12
+        optimal_schedule = self.amortization(
+                                            principal = house_prices[months] - saved_amounts[months], 
+                                            periods = mortgage_years * 12
                                         )
-                                for i in mortgage_periods
-                            ]
-        # print("principal_payments: ", principal_payments)
 
-        payments = financialEstimator.payments(principal = house_prices[months] - saved_amounts[months], interest = self.monthly_mortgage_interes, periods = mortgage_years * 12)
-        # print("payments: ", payments)
-
-        interest_payments = payments - principal_payments
+        payments = optimal_schedule['payment']
+        interest_payments = optimal_schedule['interest']
 
         optimal_cumcost = np.append(rent_prices[:months] + house_appreciation_cost[:months], np.cumsum(np.append(interest_payments[0] + rent_prices[:months][-1] + house_appreciation_cost[months], interest_payments[1:])))
 
@@ -214,55 +853,39 @@ class financialEstimator(Simulator, financialFunctions):
         '''
 
 
-        max_period = sub_optimal_df['months_to_wait'].max()
-        max_cost = sub_optimal_df['cost_function'].max()
-
-        sub_total_periods = np.arange(0, max_period + 30 * 12 + 1, dtype = int)
-        house_prices_suboptimal = np.apply_along_axis(financialEstimator.future_value, 0, sub_total_periods, present_value = self.house_price, interest = self.house_price_growth)
-        saved_amounts_suboptimal = np.apply_along_axis(financialEstimator.future_value, 0, sub_total_periods, present_value = self.initial_etf_savings, interest = self.etf_growth, payment = self.savings_per_month)
-        rent_prices_suboptimal = np.apply_along_axis(financialEstimator.future_value, 0, sub_total_periods, payment = self.rent_price, interest = self.rent_price_growth)
+        house_prices_suboptimal = house_series[:len(sub_total_periods)]
+        saved_amounts_suboptimal = saved_series[:len(sub_total_periods)]
+        rent_prices_suboptimal = rent_series[:len(sub_total_periods)]
         house_appreciation_suboptimal = house_prices_suboptimal - self.house_price
 
+        sub_months = np.round(sub_optimal_df['months_to_wait'].to_numpy(dtype = float)).astype(int) + 1
+        sub_mortgage = np.round(sub_optimal_df['mortgage_years'].to_numpy(dtype = float)).astype(int)
+        feasible = self.population_objective(np.vstack([sub_months, sub_mortgage])) != np.inf
 
-        suboptimal_int = {}
-        suboptimal_pay = {}
+        sub_interest = np.zeros(len(sub_months))
+        sub_payments = np.zeros(len(sub_months))
         suboptimal_cost = []
-        for _, row in sub_optimal_df.iterrows():
-            iter_months = int(np.round(row['months_to_wait'])) + 1
-            iter_mortgage = int(np.round(row['mortgage_years']))
-
-            if self.objective_function([iter_months, iter_mortgage]) != np.inf:
-                # print([iter_months, iter_mortgage], self.objective_function([iter_months, iter_mortgage]))
-
-                iter_mortgage_periods = np.arange(0, iter_mortgage * 12 + 1, dtype = int)
-
-                iter_principal = [financialEstimator.principal_payments(
-                                            current_period = int(i), 
-                                            initial_principal = house_prices_suboptimal[iter_months] - saved_amounts_suboptimal[iter_months], 
-                                            interest = self.monthly_mortgage_interes, 
-                                            total_periods = iter_mortgage * 12
-                                        )
-                                for i in iter_mortgage_periods
+        if feasible.any():
+            iter_months = sub_months[feasible]
+            iter_mortgage = sub_mortgage[feasible]
+
+            # one padded (scenarios x periods) schedule, zero after each term
+            iter_schedule = self.amortization(
+                                        principal = house_prices_suboptimal[iter_months] - saved_amounts_suboptimal[iter_months], 
+                                        periods = iter_mortgage * 12,
+                                        n_periods = iter_mortgage.max() * 12 + 1
+                                    )
+            iter_interest = iter_schedule['interest']
+
+            sub_interest[feasible] = iter_interest.sum(axis = 1)
+            sub_payments[feasible] = iter_schedule['payment']
+
+            waiting_cost = rent_prices_suboptimal + house_appreciation_suboptimal
+            mortgage_cumcost = np.cumsum(iter_interest, axis = 1) + waiting_cost[iter_months][:, np.newaxis]
+            suboptimal_cost = [
+                                (m, np.append(waiting_cost[:m + 1], mortgage_cumcost[k, :y * 12 + 1]))
+                                for k, (m, y) in enumerate(zip(iter_months.tolist(), iter_mortgage.tolist()))
                             ]
-                iter_payments = financialEstimator.payments(principal = house_prices_suboptimal[iter_months] - saved_amounts_suboptimal[iter_months], interest = self.monthly_mortgage_interes, periods = iter_mortgage * 12)
-
-                suboptimal_int.update({'{0}-{1}'.format(iter_months, iter_mortgage): iter_payments - iter_principal})
-                suboptimal_pay.update({'{0}-{1}'.format(iter_months, iter_mortgage): iter_payments})
-                # print(iter_principal, iter_payments)
-
-                # print('outer house val: ', house_prices_suboptimal[iter_months], ', saved mon: ', saved_amounts_suboptimal[iter_months]
-                #       , ', tot int: ', sum(iter_payments - iter_principal), ', tot_rent: ', rent_prices_suboptimal[:iter_months + 1][-1],
-                #        ', paym: ', iter_payments,'\n\n')
-                suboptimal_cost.append((iter_months, np.append(
-                                                    rent_prices_suboptimal[:iter_months + 1] + house_appreciation_suboptimal[:iter_months + 1],
-                                                    np.cumsum(np.append(
-                                                        (iter_payments - iter_principal)[0] + rent_prices_suboptimal[:iter_months + 1][-1] + house_appreciation_suboptimal[:iter_months + 1][-1],
-                                                        (iter_payments - iter_principal)[1:]
-                                                        )
-                                                    )
-                                                )
-                                            )
-                                        )
 
 
         '''
@@ -288,38 +911,34 @@ class financialEstimator(Simulator, financialFunctions):
         '''
 
 
-        def sub_opt_int_fun(x, dictio):
-            try:
-                return dictio['{0}-{1}'.format(int(np.round(x['months_to_wait'] + 1)), int(np.round(x['mortgage_years'])))]
-            except:
-                return [0]
-
-
-        sub_optimal_df['interest'] = sub_optimal_df.apply(lambda x: sum(sub_opt_int_fun(x, dictio = suboptimal_int)), axis = 1)
-        sub_optimal_df['payments'] = sub_optimal_df.apply(lambda x: sub_opt_int_fun(x, dictio = suboptimal_pay), axis = 1)
+        sub_optimal_df['interest'] = sub_interest
+        sub_optimal_df['payments'] = sub_payments
         cols_to_keep = [i for i in sub_optimal_df.columns if i != 'steps']
 
 
-        optimal_pd = pd.DataFrame([[months, mortgage_years, opt_results_obj.fun, sum(interest_payments), payments]], columns = cols_to_keep)
+        optimal_pd = pd.DataFrame([[months, mortgage_years, opt_results_obj.fun, interest_payments.sum(), payments]], columns = cols_to_keep)
 
         all_pd = pd.concat([sub_optimal_df[cols_to_keep], optimal_pd], axis = 0)
 
         all_pd['months_to_wait'] = all_pd['months_to_wait'].astype(int)
         all_pd['mortgage_years'] = all_pd['mortgage_years'].astype(int)
+        # the optimum may also be one of the sub-optimal examples
+        all_pd = all_pd.drop_duplicates(subset = ['months_to_wait', 'mortgage_years'], keep = 'last')
 
-        all_pd['house_val_at_n'] = all_pd.apply(lambda x: house_prices_suboptimal[int(x['months_to_wait'] + 1)], axis = 1)
-        all_pd['savings_at_n'] = all_pd.apply(lambda x: saved_amounts_suboptimal[int(x['months_to_wait'] + 1)], axis = 1)
-        all_pd['rent_paid_at_n'] = all_pd.apply(lambda x: rent_prices_suboptimal[int(x['months_to_wait'] + 1)], axis = 1)
-        all_pd['house_appreciation_cost'] = all_pd.apply(lambda x: house_appreciation_suboptimal[int(x['months_to_wait'] + 1)], axis = 1)
+        step_n = all_pd['months_to_wait'].to_numpy() + 1
+        all_pd['house_val_at_n'] = house_prices_suboptimal[step_n]
+        all_pd['savings_at_n'] = saved_amounts_suboptimal[step_n]
+        all_pd['rent_paid_at_n'] = rent_prices_suboptimal[step_n]
+        all_pd['house_appreciation_cost'] = house_appreciation_suboptimal[step_n]
 
 
 
         all_pd = all_pd.loc[all_pd['interest'] != 0, ['months_to_wait', 'mortgage_years', 'cost_function', 'house_val_at_n', 'house_appreciation_cost', 'savings_at_n',
             'rent_paid_at_n', 'interest', 'payments']]
         
-        for i in ['house_appreciation_cost', 'cost_function', 'house_val_at_n', 'savings_at_n',
-            'rent_paid_at_n', 'interest', 'payments']:
-            all_pd[i] = all_pd[i].apply(lambda x: round(x, 2))
+        rounded = ['house_appreciation_cost', 'cost_function', 'house_val_at_n', 'savings_at_n',
+            'rent_paid_at_n', 'interest', 'payments']
+        all_pd[rounded] = all_pd[rounded].round(2)
         
         all_pd.columns = ['months_to_wait', 'mortgage_years', 'cost_function', 'house_value_at_step n', 'house_appreciation_cost', 'savings_at_step n',
             'rent_paid_at_step n', 'interest', 'payments']
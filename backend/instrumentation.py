@@ -0,0 +1,183 @@
+from contextlib import contextmanager, nullcontext
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+
+class stageTracer:
+    """Timing spans and counters for the pipeline stages.
+
+    Disabled by default (set MORTGAGE_TRACE=1 or call `enable`), in which case
+    `span` hands back a null context and `count` returns straight away. With
+    `profile = True` every outermost span also runs under cProfile and the
+    accumulated stats are part of the report."""
+
+    def __init__(self, enabled = False, profile = False):
+        self.enabled = enabled
+        self.profile = profile
+        self.spans = []
+        self.counters = {}
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiler = None
+
+    def __getstate__(self):
+        # worker processes get a disabled tracer: their spans would never come back
+        return {'enabled': False, 'profile': False}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def enable(self, profile = False):
+        self.enabled = True
+        self.profile = profile
+
+    def disable(self):
+        self.enabled = False
+        self.profile = False
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self.counters = {}
+            self._profiler = None
+            self._origin = time.perf_counter()
+
+    def count(self, name, n = 1):
+        if not self.enabled:
+            return
+        target = self._target()
+        with target._lock:
+            target.counters[name] = target.counters.get(name, 0) + n
+
+    @contextmanager
+    def collect(self):
+        """Records the spans and counters of this thread within the block
+        into a new tracer, which it yields, instead of this one; e.g. to
+        log one job of a shared pool on its own."""
+        collector = stageTracer(enabled = self.enabled)
+        previous = getattr(self._local, 'collector', None)
+        self._local.collector = collector
+        try:
+            yield collector
+        finally:
+            self._local.collector = previous
+
+    def _target(self):
+        collector = getattr(self._local, 'collector', None)
+        return self if collector is None else collector
+
+    def span(self, name, **tags):
+        """Context manager timing a block. It yields the span's tag dict, so
+        the block can attach results (`tags['fun'] = ...`) as it goes."""
+        if not self.enabled:
+            return nullcontext({})
+        return self._span(name, tags)
+
+    @contextmanager
+    def _span(self, name, tags):
+        stack = self._local.__dict__.setdefault('stack', [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        profiler = self._start_profiler() if self.profile and parent is None else None
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield tags
+        finally:
+            wall, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+            if profiler is not None:
+                profiler.disable()
+            stack.pop()
+            target = self._target()
+            with target._lock:
+                target.spans.append({
+                    'name': name,
+                    'parent': parent,
+                    'depth': len(stack),
+                    'thread': threading.current_thread().name,
+                    'start': start - target._origin,
+                    'wall_time': wall,
+                    'cpu_time': cpu,
+                    'tags': tags
+                })
+
+    def _start_profiler(self):
+        with self._lock:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            profiler = self._profiler
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler (or another thread's span) already owns the hook
+            return None
+        return profiler
+
+    def summary(self):
+        """Per span name: calls, total, mean and max wall time."""
+        summary = {}
+        for span in self.spans:
+            entry = summary.setdefault(span['name'], {'calls': 0, 'total': 0., 'max': 0.})
+            entry['calls'] += 1
+            entry['total'] += span['wall_time']
+            entry['max'] = max(entry['max'], span['wall_time'])
+        for entry in summary.values():
+            entry['mean'] = entry['total'] / entry['calls']
+        return summary
+
+    def profile_stats(self, sort = 'cumulative', limit = 30):
+        if self._profiler is None:
+            return ''
+        stream = io.StringIO()
+        pstats.Stats(self._profiler, stream = stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def report(self, counters = None):
+        """Plain-data report; `counters` are merged over the recorded ones
+        (e.g. cache statistics kept elsewhere)."""
+        report = {
+            'spans': list(self.spans),
+            'counters': {**self.counters, **(counters or {})},
+            'summary': self.summary()
+        }
+        if self._profiler is not None:
+            report['profile'] = self.profile_stats()
+        return report
+
+    def to_json(self, path = None, counters = None):
+        text = json.dumps(self.report(counters = counters), indent = 2, default = str)
+        if path is not None:
+            with open(path, 'w') as file:
+                file.write(text)
+        return text
+
+    def log(self, logger = None, level = logging.INFO):
+        """One structured (JSON) log line per span, then one for the counters."""
+        logger = logging.getLogger('mortgage.trace') if logger is None else logger
+        for span in self.spans:
+            logger.log(level, json.dumps(span, default = str))
+        logger.log(level, json.dumps({'counters': self.counters}, default = str))
+
+
+# process-wide tracer the estimator, fetcher and plotters record into
+TRACER = stageTracer(enabled = os.environ.get('MORTGAGE_TRACE', '') not in ('', '0'))
+
+
+def traced(name):
+    """Decorator running the function inside a TRACER span."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,207 @@
+"""Numba-compiled kernels for the hot loops of the financial engine.
+
+Numba is optional: when it is importable (and MORTGAGE_JIT is not set to 0)
+the objective, for single points and for batches, and the amortization
+schedule go through the kernels below, otherwise the NumPy code runs. The
+kernels follow the NumPy expressions operation by operation, reading the
+same growth tables, so both paths give the same results; `verify` checks
+that they do.
+"""
+import importlib.util
+import multiprocessing
+import numpy as np
+import os
+import threading
+
+# kernels are launched from worker threads (job pool, Streamlit script
+# threads), possibly at once: prefer OpenMP, as TBB can hang at exit after
+# that. Set before numba is imported, it reads its configuration from the environment
+os.environ.setdefault('NUMBA_THREADING_LAYER_PRIORITY', 'omp tbb workqueue')
+
+
+# numba is only imported (and the kernels only compiled) on first use
+AVAILABLE = importlib.util.find_spec('numba') is not None
+ENABLED = AVAILABLE and os.environ.get('MORTGAGE_JIT', '1') not in ('', '0')
+
+# below this many cells the parallel objective costs more to start than it saves
+PARALLEL_CELLS = 1 << 14
+
+KERNELS = ('future_value', 'payments', 'objective_point', 'objective_cells', 'objective_cells_parallel', 'amortization_loans')
+
+_load_lock = threading.Lock()
+
+
+def enable(enabled = True):
+    """Switches the kernels on or off at runtime (on only if numba is available)."""
+    global ENABLED
+    ENABLED = AVAILABLE and enabled
+
+
+def pool_context():
+    """multiprocessing context for process pools. Forking a process after a
+    parallel kernel ran breaks the children (OpenMP) or hangs at exit (TBB),
+    so workers start from a fork server, or are spawned where there is none."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _future_value(period, rate, factors, present_value, payment):
+    """`financialFunctions.future_value_table` for one period."""
+    return present_value * factors[period] + payment / rate * (factors[period] - 1)
+
+
+def _payments(principal, annuity, periods):
+    """`financialFunctions.payments_table` for one loan."""
+    return principal * annuity[periods]
+
+
+def _objective_point(months, years, house_price, house_factors, initial_savings, savings_per_month, etf_rate, etf_factors,
+                     rent_price, rent_rate, rent_factors, mortgage_annuity, threshold):
+    """Masked cost of one (months, years) point, as `batch_objective` prices it."""
+    house = house_price * house_factors[months]
+    saved = future_value(months, etf_rate, etf_factors, initial_savings, savings_per_month)
+    rent = future_value(months, rent_rate, rent_factors, 0., rent_price)
+    principal = house - saved
+    payment = payments(principal, mortgage_annuity, years * 12)
+    if payment > threshold or saved > house:
+        return np.inf
+    interest = payment * years * 12 - principal
+    return interest + rent + (house - house_price)
+
+
+def _objective_cells(months, years, house_price, house_factors, initial_savings, savings_per_month, etf_rate, etf_factors,
+                     rent_price, rent_rate, rent_factors, mortgage_annuity, threshold):
+    cost = np.empty(len(months))
+    for k in prange(len(months)):
+        cost[k] = objective_point(months[k], years[k], house_price, house_factors, initial_savings, savings_per_month, etf_rate, etf_factors,
+                                  rent_price, rent_rate, rent_factors, mortgage_annuity, threshold)
+    return cost
+
+
+def _amortization(principal, periods, n_periods, rate, factors, annuity):
+    payment = np.empty(len(principal))
+    principal_paid = np.zeros((len(principal), n_periods))
+    interest_paid = np.zeros((len(principal), n_periods))
+    balance = np.zeros((len(principal), n_periods))
+    for k in range(len(principal)):
+        payment[k] = payments(principal[k], annuity, periods[k])
+        for step in range(min(periods[k], n_periods)):
+            opening_balance = future_value(step, rate, factors, principal[k], -payment[k])
+            interest_paid[k, step] = opening_balance * rate
+            principal_paid[k, step] = payment[k] - interest_paid[k, step]
+            balance[k, step] = opening_balance - principal_paid[k, step]
+    return payment, principal_paid, interest_paid, balance
+
+
+def _load():
+    """Imports numba and binds the KERNELS (the plain functions above
+    without it); the kernels call each other through these module names."""
+    global prange, future_value, payments, objective_point, objective_cells, objective_cells_parallel, amortization_loans
+    with _load_lock:
+        if 'objective_point' in globals():
+            return
+        if AVAILABLE:
+            import numba
+            jit = numba.njit(cache = True)
+            jit_parallel = numba.njit(cache = True, parallel = True)
+            prange = numba.prange
+        else:
+            jit = jit_parallel = lambda function: function
+            prange = range
+
+        future_value = jit(_future_value)
+        payments = jit(_payments)
+        objective_cells = jit(_objective_cells)
+        objective_cells_parallel = jit_parallel(_objective_cells)
+        # a few hundred steps per loan, not worth starting the threading layer for
+        amortization_loans = jit(_amortization)
+        # bound last, it marks the kernels as loaded
+        objective_point = jit(_objective_point)
+
+
+def __getattr__(name):
+    if name in KERNELS:
+        _load()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def objective(months, years, house_price, house_table, initial_savings, savings_per_month, etf_table,
+              rent_price, rent_table, mortgage_table, threshold):
+    """Masked cost of every (months, years) pair, broadcast against each
+    other, as `masked_cost(cost_components(...))` prices it."""
+    _load()
+    months, years = np.broadcast_arrays(np.asarray(months, dtype = np.int64), np.asarray(years, dtype = np.int64))
+    kernel = objective_cells_parallel if months.size >= PARALLEL_CELLS else objective_cells
+    cost = kernel(
+                np.ascontiguousarray(months).ravel(), np.ascontiguousarray(years).ravel(),
+                float(house_price), house_table.factors,
+                float(initial_savings), float(savings_per_month), float(etf_table.rate), etf_table.factors,
+                float(rent_price), float(rent_table.rate), rent_table.factors,
+                mortgage_table.annuity, float(threshold)
+                )
+    return cost.reshape(months.shape)[()]
+
+
+def amortization_schedule(principal, periods, n_periods, table):
+    """`financialFunctions.amortization_schedule` read from the growth
+    `table`, one compiled loop over the loans."""
+    _load()
+    principal, periods = np.broadcast_arrays(np.asarray(principal, dtype = float), np.asarray(periods, dtype = np.int64))
+    shape = principal.shape
+    payment, principal_paid, interest_paid, balance = amortization_loans(
+                np.ascontiguousarray(principal).ravel(), np.ascontiguousarray(periods).ravel(),
+                int(n_periods), float(table.rate), table.factors, table.annuity
+                )
+    interest_paid = interest_paid.reshape(shape + (n_periods,))
+    return {
+        'payment': payment.reshape(shape)[()],
+        'principal': principal_paid.reshape(shape + (n_periods,)),
+        'interest': interest_paid,
+        'balance': balance.reshape(shape + (n_periods,)),
+        'cumulative_interest': np.cumsum(interest_paid, axis = -1)
+    }
+
+
+def verify(inputs, points = 2000, seed = 0):
+    """Prices `inputs` (financialEstimator arguments) with the kernels and
+    with NumPy and returns the largest relative difference of every kernel;
+    raises if the kernels are unavailable or any result differs beyond 1e-12."""
+    from backend.financialSim import financialEstimator
+    if not AVAILABLE:
+        raise RuntimeError('numba is not installed, there are no kernels to verify')
+
+    enabled = ENABLED
+    rng = np.random.default_rng(seed)
+    months = rng.integers(1, 481, points)
+    years = rng.integers(1, 31, points)
+    principal = rng.uniform(0.2, 1.5, 64) * inputs['house_price']
+    terms = rng.integers(1, 31, 64) * 12
+
+    def run():
+        estimator = financialEstimator(**inputs)
+        return {
+            'objective_point': np.array([estimator.objective_function(point) for point in zip(months[:200], years[:200])]),
+            'objective': estimator.batch_objective(months, years),
+            'objective_grid': estimator.batch_objective(np.arange(1, 481)[np.newaxis, :], np.arange(1, 31)[:, np.newaxis]),
+            'amortization': estimator.amortization(principal, terms, n_periods = 30 * 12 + 1)['balance']
+        }
+
+    try:
+        enable(True)
+        compiled = run()
+        enable(False)
+        reference = run()
+    finally:
+        enable(enabled)
+
+    errors = {}
+    for name, value in compiled.items():
+        finite = np.isfinite(reference[name])
+        if (finite != np.isfinite(value)).any():
+            raise AssertionError(f"'{name}' kernel masks other cells than NumPy")
+        scale = np.maximum(np.abs(reference[name][finite]), 1.)
+        errors[name] = float(np.max(np.abs(value[finite] - reference[name][finite]) / scale, initial = 0.))
+        if errors[name] > 1e-12:
+            raise AssertionError(f"'{name}' kernel differs from NumPy by {errors[name]:.3g}")
+    return errors
@@ -0,0 +1,119 @@
+from backend.instrumentation import TRACER
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+class job:
+    """Handle of a submitted job: its `steps` run in order on one worker and
+    every step's result is published as soon as it is ready, so a caller
+    can use the first results while the rest are still being computed."""
+
+    def __init__(self, key, steps):
+        self.key = key
+        self.steps = list(steps)
+        self.submitted = time.time()
+        self.finished = None
+        self.error = None
+        self.future = None
+        self.trace = None # stageTracer of the spans and counters recorded while running
+        self._results = [None] * len(self.steps)
+        self._ready = [threading.Event() for _ in self.steps]
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def ready(self, index):
+        return self._ready[index].is_set()
+
+    def result(self, index, timeout = None):
+        """Result of step `index`, waiting up to `timeout` seconds (forever
+        by default) for it; re-raises the error of a failed job."""
+        if not self._ready[index].wait(timeout):
+            raise TimeoutError(f"Step {index} of job '{self.key}' is not ready")
+        if self.error is not None and self._results[index] is None:
+            raise self.error
+        return self._results[index]
+
+    def partial(self):
+        """Results of the steps finished so far, None for the others."""
+        return [result if ready.is_set() else None for result, ready in zip(self._results, self._ready)]
+
+    def _run(self):
+        try:
+            with TRACER.collect() as self.trace, TRACER.span('job', steps = len(self.steps)):
+                for index, step in enumerate(self.steps):
+                    self._results[index] = step()
+                    self._ready[index].set()
+        except BaseException as error:
+            self.error = error
+            raise
+        finally:
+            self.finished = time.time()
+            # wake every waiter, a failed job's missing steps raise its error
+            for ready in self._ready:
+                ready.set()
+
+
+class jobRunner:
+    """Shared worker pool for dashboard submissions.
+
+    Jobs are keyed (e.g. on `resultCache.make_key` of the form values):
+    submitting a key that is already in flight or finished hands back the
+    existing job instead of starting the work again, and the latest
+    `max_jobs` finished jobs stay retrievable with `get`, so a rerun picks
+    up where the previous run left off. Threads are used rather than
+    processes, since the results (figures, frames) are consumed in-process
+    and the heavy lifting happens in NumPy."""
+
+    def __init__(self, max_workers = 4, max_jobs = 32):
+        self.max_jobs = max_jobs
+        self.submitted = 0
+        self.deduplicated = 0
+        self._pool = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'mortgage-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, steps):
+        with self._lock:
+            existing = self._jobs.get(key)
+            if existing is not None and not existing.failed:
+                self._jobs.move_to_end(key)
+                self.deduplicated += 1
+                TRACER.count('jobs_deduplicated')
+                return existing
+
+            new_job = job(key, steps)
+            new_job.future = self._pool.submit(new_job._run)
+            self._jobs[key] = new_job
+            self.submitted += 1
+            TRACER.count('jobs_submitted')
+            self._evict()
+            return new_job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def stats(self):
+        with self._lock:
+            running = sum(not item.done for item in self._jobs.values())
+            return {'submitted': self.submitted, 'deduplicated': self.deduplicated, 'jobs': len(self._jobs), 'running': running}
+
+    def shutdown(self, wait = True):
+        self._pool.shutdown(wait = wait)
+
+    def _evict(self):
+        # only finished jobs are dropped, in-flight ones must stay to be deduplicated
+        finished = [key for key, item in self._jobs.items() if item.done]
+        for key in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[key]
@@ -0,0 +1,250 @@
+from backend import jitKernels
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import os
+
+
+# estimator attributes that can follow a stochastic path
+STOCHASTIC_RATES = ('house_price_growth', 'rent_price_growth', 'etf_growth', 'monthly_mortgage_interes')
+
+
+class rateModel:
+    """Monthly rate process for the Monte Carlo mode.
+
+    'lognormal' draws independent monthly gross returns 1 + r with mean
+    1 + `mean`; 'ar1' mean-reverts, r_t = mean + persistence * (r_t-1 - mean)
+    + volatility * e_t, starting at the mean. `mean` defaults to the
+    estimator's constant rate."""
+    KINDS = ('lognormal', 'ar1')
+
+    def __init__(self, kind = 'lognormal', volatility = 0., mean = None, persistence = 0.9):
+        if kind not in rateModel.KINDS:
+            raise ValueError(f"Unknown rate model '{kind}', expected one of {rateModel.KINDS}")
+        self.kind = kind
+        self.volatility = volatility
+        self.mean = mean
+        self.persistence = persistence
+
+    def sample(self, rng, mean, paths, months):
+        """(paths x months) monthly rates."""
+        mean = mean if self.mean is None else self.mean
+        shocks = rng.standard_normal((paths, months))
+        if self.kind == 'lognormal':
+            sigma = self.volatility
+            return np.expm1(np.log1p(mean) - sigma**2 / 2 + sigma * shocks)
+        from scipy.signal import lfilter
+        return mean + lfilter([1.], [1., -self.persistence], self.volatility * shocks, axis = 1)
+
+
+def simulate_rates(params, models, paths, months, seed = None):
+    """Rate paths of every attribute in STOCHASTIC_RATES: (paths x months)
+    arrays for the modelled ones, the constant rate for the others. The
+    same seed always gives the same paths."""
+    rng = np.random.default_rng(seed)
+    rates = {}
+    for name in STOCHASTIC_RATES:
+        if name in models:
+            rates[name] = models[name].sample(rng, params[name], paths, months)
+        else:
+            rates[name] = params[name]
+    return rates
+
+
+def growth_paths(rate, paths, months):
+    """(paths x months + 1) cumulative growth G_n = prod_{t < n} (1 + rate_t)."""
+    growth = np.ones((paths, months + 1))
+    np.cumprod(1 + np.broadcast_to(rate, (paths, months)), axis = 1, out = growth[:, 1:])
+    return growth
+
+
+def month_paths(params, rates, paths, months_wait):
+    """Per path and month to wait: house value, savings, rent paid and the
+    mortgage rate locked at purchase, each (paths x months). Savings and rent
+    follow S_n = S_n-1 * (1 + rate_n-1) + payment, as `future_value` does for
+    a constant rate."""
+    horizon = int(months_wait.max())
+    def growth(name):
+        rate = rates[name]
+        return growth_paths(rate[:, :horizon] if np.ndim(rate) else rate, paths, horizon)
+
+    house_growth = growth('house_price_growth')
+    etf_growth = growth('etf_growth')
+    rent_growth = growth('rent_price_growth')
+
+    def annuity_value(growth, present_value, payment):
+        discounted = np.zeros_like(growth)
+        np.cumsum(1 / growth[:, 1:], axis = 1, out = discounted[:, 1:])
+        return growth * (present_value + payment * discounted)
+
+    house = params['house_price'] * house_growth[:, months_wait]
+    savings = annuity_value(etf_growth, params['initial_etf_savings'], params['savings_per_month'])[:, months_wait]
+    rent = annuity_value(rent_growth, 0., params['rent_price'])[:, months_wait]
+
+    mortgage_rate = rates['monthly_mortgage_interes']
+    if np.ndim(mortgage_rate):
+        mortgage_rate = mortgage_rate[:, months_wait]
+    return house, savings, rent, mortgage_rate
+
+
+# paths simulated together: bounds the memory of the (paths x months) arrays
+PATH_CHUNK = 1000
+# histogram bins per cell the percentiles are read from
+HISTOGRAM_BINS = 512
+
+
+def path_chunks(seed, paths, path_chunk = PATH_CHUNK):
+    """(paths, seed) of every chunk of `paths`, each with its own seed spawned
+    from `seed`, so the paths do not depend on how chunks are spread over
+    workers."""
+    sizes = [path_chunk] * (paths // path_chunk) + ([paths % path_chunk] if paths % path_chunk else [])
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def term_costs(params, mortgage_years, house, savings, rent, mortgage_rate):
+    """Yields per mortgage term its index and the (paths x months) cost, inf
+    where infeasible."""
+    principal = house - savings
+    # everything but the mortgage payments, shared by every term
+    base = rent + (house - params['house_price']) - principal
+    exceeded = savings > house
+    log_rate = np.log1p(mortgage_rate)
+
+    for j, years in enumerate(mortgage_years):
+        periods = int(years) * 12
+        compounded = np.exp(periods * log_rate)
+        payments = principal * (mortgage_rate * compounded / (compounded - 1))
+        cost = payments * periods + base
+        cost[(payments > params['intallment_threshold']) | exceeded] = np.inf
+        yield j, cost
+
+
+def chunk_costs(params, models, chunks, months_wait, mortgage_years):
+    """Yields per chunk of paths the generator of its `term_costs`."""
+    for paths, seed in chunks:
+        rates = simulate_rates(params, models, paths, int(months_wait.max()) + 1, seed)
+        yield term_costs(params, mortgage_years, *month_paths(params, rates, paths, months_wait))
+
+
+def range_pass(params, models, chunks, months_wait, mortgage_years, percentiles = None):
+    """First pass over `chunks`: per (term, month) cell the lowest and highest
+    finite cost and the number of feasible paths and of paths it is the
+    optimum of. With a single chunk, its exact `percentiles` rows
+    (percentiles x terms x months) can be taken on the way as well."""
+    shape = (len(mortgage_years), len(months_wait))
+    low = np.full(shape, np.inf)
+    high = np.full(shape, -np.inf)
+    feasible = np.zeros(shape, dtype = np.int64)
+    optimal = np.zeros(shape[0] * shape[1], dtype = np.int64)
+    quantiles = None if percentiles is None else np.empty((len(percentiles),) + shape)
+
+    for costs in chunk_costs(params, models, chunks, months_wait, mortgage_years):
+        best_cost = best_cell = None
+        for j, cost in costs:
+            if quantiles is not None:
+                # no interpolation, so infeasible (inf) paths give inf instead of nan;
+                # partitioning contiguous (months x paths) rows is much faster than columns
+                quantiles[:, j] = np.percentile(np.ascontiguousarray(cost.T), percentiles, axis = 1, method = 'inverted_cdf')
+            finite = np.isfinite(cost)
+            feasible[j] += finite.sum(axis = 0)
+            np.minimum(low[j], cost.min(axis = 0), out = low[j])
+            np.maximum(high[j], np.where(finite, cost, -np.inf).max(axis = 0), out = high[j])
+
+            i = np.argmin(cost, axis = 1)
+            row_min = cost[np.arange(len(i)), i]
+            if best_cost is None:
+                best_cost, best_cell = np.full(len(i), np.inf), np.zeros(len(i), dtype = int)
+            better = row_min < best_cost
+            best_cost[better] = row_min[better]
+            best_cell[better] = j * shape[1] + i[better]
+        optimal += np.bincount(best_cell[np.isfinite(best_cost)], minlength = optimal.size)
+
+    return low, high, feasible, optimal.reshape(shape), quantiles
+
+
+def histogram_pass(params, models, chunks, months_wait, mortgage_years, low, high, bins = HISTOGRAM_BINS):
+    """Second pass over `chunks`: per cell, counts of the costs in `bins`
+    equal bins between its `low` and `high`, (terms x months x bins).
+    Infeasible paths are counted in the last bin."""
+    counts = np.zeros((len(mortgage_years), len(months_wait), bins), dtype = np.int32)
+    # cells without a feasible path have no range, all of their paths are infeasible
+    low = np.where(np.isfinite(low), low, 0.)
+    scale = bins / np.where(high > low, high - low, 1.)
+    offsets = np.arange(len(months_wait)) * bins
+
+    for costs in chunk_costs(params, models, chunks, months_wait, mortgage_years):
+        for j, cost in costs:
+            position = np.multiply(np.subtract(cost, low[j], out = cost), scale[j], out = cost)
+            index = np.clip(position, 0, bins - 1, out = position).astype(np.intp)
+            index += offsets
+            counts[j] += np.bincount(index.ravel(), minlength = counts[j].size).reshape(counts[j].shape)
+    return counts
+
+
+def histogram_percentiles(counts, low, high, paths, percentiles):
+    """Per cell, the `percentiles` of the costs of `paths` paths from the
+    `counts` of their finite costs, infeasible paths counting as inf. The rank is the
+    'inverted_cdf' one; within its bin the costs are taken as evenly spread,
+    so it is off by at most a bin width, (high - low) / bins."""
+    bins = counts.shape[-1]
+    width = np.where(high > low, high - low, 0.) / bins
+    cumulative = np.cumsum(counts, axis = -1, dtype = counts.dtype)
+    surfaces = {}
+    for q in percentiles:
+        rank = max(int(np.ceil(q / 100 * paths)), 1)
+        reached = cumulative >= rank
+        b = np.argmax(reached, axis = -1)[..., None]
+        before = np.where(b > 0, np.take_along_axis(cumulative, np.maximum(b - 1, 0), axis = -1), 0)[..., 0]
+        inside = np.take_along_axis(counts, b, axis = -1)[..., 0]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            value = low + width * (b[..., 0] + (rank - before) / (inside + 1))
+        # the lowest and highest costs are known exactly
+        value = np.where(rank == 1, low, np.where(rank == cumulative[..., -1], high, value))
+        surfaces[q] = np.where(reached[..., -1], np.clip(value, low, high), np.inf)
+    return surfaces
+
+
+def monte_carlo_surfaces(params, months_wait, mortgage_years, models, paths = 10000, percentiles = (5, 50, 95), seed = None, workers = 1, path_chunk = PATH_CHUNK):
+    """Cost surfaces under stochastic rates, see `financialEstimator.monte_carlo`."""
+    unknown = set(models) - set(STOCHASTIC_RATES)
+    if unknown:
+        raise ValueError(f"No stochastic model for {sorted(unknown)}, expected some of {STOCHASTIC_RATES}")
+    if seed is None:
+        # both passes rebuild the paths from the seed, so it has to be fixed up front
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+    chunks = path_chunks(seed, paths, path_chunk)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    groups = [chunks[k::workers] for k in range(min(max(workers, 1), len(chunks)))]
+    common = (params, models)
+    axes = (months_wait, mortgage_years)
+
+    if len(chunks) == 1:
+        # every path at once: exact percentiles in a single pass
+        low, high, feasible, optimal, quantiles = range_pass(*common, chunks, *axes, percentiles)
+        surfaces = {q: quantiles[k] for k, q in enumerate(percentiles)}
+    else:
+        if len(groups) == 1:
+            low, high, feasible, optimal, _ = range_pass(*common, chunks, *axes)
+            counts = histogram_pass(*common, chunks, *axes, low, high)
+        else:
+            repeat = lambda value: [value] * len(groups)
+            with ProcessPoolExecutor(max_workers = len(groups), mp_context = jitKernels.pool_context()) as pool:
+                ranges = list(pool.map(range_pass, *map(repeat, common), groups, *map(repeat, axes)))
+                low = np.minimum.reduce([result[0] for result in ranges])
+                high = np.maximum.reduce([result[1] for result in ranges])
+                feasible = sum(result[2] for result in ranges)
+                optimal = sum(result[3] for result in ranges)
+                counts = sum(pool.map(histogram_pass, *map(repeat, common), groups, *map(repeat, axes), repeat(low), repeat(high)))
+        # the percentiles count infeasible paths from `feasible`, not from the last bin
+        counts[..., -1] -= paths - feasible
+        surfaces = histogram_percentiles(counts, low, high, paths, percentiles)
+
+    return {
+        'months_wait': months_wait,
+        'mortgage_years': mortgage_years,
+        'percentiles': surfaces,
+        'feasible_probability': feasible / paths,
+        'optimal_probability': optimal / paths,
+        'paths': paths,
+        'seed': seed
+    }
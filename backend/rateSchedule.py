@@ -0,0 +1,106 @@
+import numpy as np
+
+
+class rateSchedule:
+    """Mortgage rate over the life of a loan, as fixed-rate segments.
+
+    Segment k starts `starts[k]` months after the loan is drawn and runs at
+    the monthly rate `rates[k]` until the next one starts; the last one runs
+    to the end of the term. Without `starts`, `rates` is a per-period rate
+    vector (its last rate carrying on past its end), and runs of equal rates
+    are merged into one segment. At every refix the payment is recomputed so
+    the balance amortizes over the remaining term at the new rate.
+
+    A segment takes its opening balance B to B * (1 + r)**L - payment *
+    ((1 + r)**L - 1) / r with payment = B * annuity(r, remaining term), so
+    the schedule is linear in the principal: payments, balances and interest
+    are the principal times factors depending only on the term, priced in
+    closed form per segment and broadcast over terms."""
+
+    def __init__(self, rates, starts = None):
+        rates = np.atleast_1d(np.asarray(rates, dtype = float))
+        if not len(rates):
+            raise ValueError('A rate schedule needs at least one rate')
+        if starts is None:
+            keep = np.append(True, rates[1:] != rates[:-1])
+            starts, rates = np.flatnonzero(keep), rates[keep]
+        starts = np.atleast_1d(np.asarray(starts, dtype = int))
+
+        if len(starts) != len(rates):
+            raise ValueError('A rate schedule needs one start month per rate')
+        if starts[0] != 0 or (np.diff(starts) <= 0).any():
+            raise ValueError('Segment starts must begin at 0 and increase')
+        self.rates = rates
+        self.starts = starts
+
+    @classmethod
+    def refixing(cls, rates, fixed_years):
+        """Schedule refixing after each of `fixed_years` (one entry per rate,
+        the last one may be left out as it runs to the end of the term)."""
+        fixed_months = np.asarray(fixed_years, dtype = int)[:len(rates) - 1] * 12
+        return cls(rates, starts = np.append(0, np.cumsum(fixed_months)))
+
+    @property
+    def key(self):
+        """Hashable, JSON-safe description, used in the estimator's `params_key`."""
+        return ';'.join(f'{start}:{rate!r}' for start, rate in zip(self.starts.tolist(), self.rates.tolist()))
+
+    def __repr__(self):
+        return f'rateSchedule({self.key})'
+
+    def segment_factors(self, periods):
+        """Per unit of principal, for loans of `periods` months (any shape,
+        segments on a new trailing axis): the balance each segment opens
+        with, its monthly payment and the number of months it runs."""
+        periods = np.asarray(periods)[..., np.newaxis]
+        ends = np.append(self.starts[1:], np.iinfo(np.int64).max)
+        length = np.clip(np.minimum(ends, periods) - self.starts, 0, None)
+        remaining = np.maximum(periods - self.starts, 1)
+
+        compounded = (1 + self.rates)**remaining
+        annuity = self.rates * compounded / (compounded - 1)
+        segment_growth = (1 + self.rates)**length
+        closing = segment_growth - annuity * (segment_growth - 1) / self.rates
+
+        opening = np.ones(closing.shape)
+        np.cumprod(closing[..., :-1], axis = -1, out = opening[..., 1:])
+        return opening, opening * annuity, length
+
+    def loan_factors(self, periods):
+        """Per unit of principal and loan term in `periods`: the largest
+        monthly payment over the schedule and the total paid."""
+        _, payment, length = self.segment_factors(periods)
+        return np.where(length > 0, payment, 0.).max(axis = -1), (payment * length).sum(axis = -1)
+
+    def amortization_schedule(self, principal, periods, n_periods = None):
+        """`financialFunctions.amortization_schedule` under this schedule:
+        the same layout and keys, where 'payment' is the first payment and
+        'payments' holds the payment of every period."""
+        principal = np.asarray(principal, dtype = float)[..., np.newaxis]
+        periods = np.asarray(periods)[..., np.newaxis]
+        if n_periods is None:
+            n_periods = int(np.max(periods))
+
+        opening, payment, _ = self.segment_factors(periods[..., 0])
+        steps = np.arange(n_periods)
+        segment = np.searchsorted(self.starts, steps, side = 'right') - 1
+        rate = self.rates[segment]
+        growth = (1 + rate)**(steps - self.starts[segment])
+
+        segment_payment = principal * payment[..., segment]
+        opening_balance = principal * opening[..., segment] * growth - segment_payment * (growth - 1) / rate
+
+        active = steps < periods
+        interest_paid = np.where(active, opening_balance * rate, 0.)
+        payments = np.where(active, segment_payment, 0.)
+        principal_paid = payments - interest_paid
+        balance = np.where(active, opening_balance - principal_paid, 0.)
+
+        return {
+            'payment': (principal[..., 0] * payment[..., 0])[()],
+            'payments': payments,
+            'principal': principal_paid,
+            'interest': interest_paid,
+            'balance': balance,
+            'cumulative_interest': np.cumsum(interest_paid, axis = -1)
+        }
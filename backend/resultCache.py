@@ -0,0 +1,147 @@
+from backend.instrumentation import TRACER
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+
+class resultCache:
+    """Process-wide cache of computed dataFetcher stages, shared by every
+    session of the app, with an optional on-disk store behind it.
+
+    Entries are keyed on the normalized form values, are kept pickled (so a
+    hit never hands two sessions the same mutable objects), expire after
+    `ttl` seconds and are evicted least-recently-used once the store goes
+    over `max_bytes`."""
+
+    def __init__(self, max_bytes = 256 * 2**20, ttl = 24 * 3600, directory = None, max_disk_bytes = 2**30):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (created at, pickled payload)
+        self._size = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok = True)
+
+    @staticmethod
+    def make_key(form_values, installment_threshold, **extra):
+        """Stable key for a submission: numbers are normalized so that 4000,
+        4000.0 and 4000.0000000001 hit the same entry."""
+        def normalize(value):
+            if isinstance(value, (int, float)):
+                return round(float(value), 10)
+            return value
+
+        values = {k: normalize(v) for k, v in form_values.items()}
+        values['__installment_threshold'] = normalize(installment_threshold)
+        values.update({f'__{k}': normalize(v) for k, v in extra.items()})
+        return hashlib.sha256(json.dumps(values, sort_keys = True).encode()).hexdigest()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._size}
+
+    def get(self, key):
+        with self._lock:
+            payload = self._get_memory(key)
+        if payload is None:
+            payload = self._get_disk(key)
+            if payload is not None:
+                with self._lock:
+                    self._put_memory(key, payload)
+
+        if payload is None:
+            self.misses += 1
+            TRACER.count('result_cache_misses')
+            return None
+        self.hits += 1
+        TRACER.count('result_cache_hits')
+        return pickle.loads(payload)
+
+    def put(self, key, value):
+        payload = pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._put_memory(key, payload)
+        self._put_disk(key, payload)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _get_memory(self, key):
+        if key not in self._entries:
+            return None
+        created, payload = self._entries[key]
+        if time.time() - created > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def _put_memory(self, key, payload):
+        if key in self._entries:
+            self._drop(key)
+        if len(payload) > self.max_bytes:
+            return
+        self._entries[key] = (time.time(), payload)
+        self._size += len(payload)
+        while self._size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, payload = self._entries.pop(key)
+        self._size -= len(payload)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def _get_disk(self, key):
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            if time.time() - os.path.getmtime(self._path(key)) > self.ttl:
+                os.remove(self._path(key))
+                return None
+            with open(self._path(key), 'rb') as file:
+                return file.read()
+        except OSError:
+            # another worker evicted it in the meantime
+            return None
+
+    def _put_disk(self, key, payload):
+        if self.directory is None:
+            return
+        tmp_path = f'{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(payload)
+        os.replace(tmp_path, self._path(key))
+
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.pkl'):
+                try:
+                    files.append((os.path.getmtime(path), os.path.getsize(path), path))
+                except OSError:
+                    pass
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,115 @@
+"""Offline batch runner: prices scenario rows read from a CSV or Parquet file.
+
+    python batchRunner.py clients.csv optimum.csv --scenarios tables.parquet --workers 4
+
+The input has one column per `financialEstimator.__init__` argument
+(`initial_etf_savings` is optional) and is streamed in chunks, so memory
+stays flat whatever its size. For every row the output gets the optimal
+months_to_wait, mortgage_years, cost_function and payments; with
+`--scenarios` the scenario3 summary table of every row is written too,
+tagged with the row number.
+"""
+from backend import jitKernels
+from backend.batchPricer import PARAMETERS, price_batch
+from concurrent.futures import ProcessPoolExecutor
+from dataFetcher import dataFetcher
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def read_chunks(path, chunk_size):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size = chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize = chunk_size)
+
+
+class tableWriter:
+    """Appends DataFrames to a CSV or Parquet file as they are produced."""
+
+    def __init__(self, path):
+        self.path = path
+        self._started = False
+        self._parquet = None
+
+    def write(self, data):
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._parquet is None:
+                table = pa.Table.from_pandas(data, preserve_index = False)
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = pa.Table.from_pandas(data, schema = self._parquet.schema, preserve_index = False)
+            self._parquet.write_table(table)
+        else:
+            data.to_csv(self.path, mode = 'a' if self._started else 'w', header = not self._started, index = False)
+        self._started = True
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def scenario_table(row):
+    """scenario3 summary table for one input row (process-pool entry point)."""
+    kwargs = {name: row.get(name, default) for name, default in PARAMETERS.items()}
+    fetcher = dataFetcher(**kwargs, optimizer = 'grid')
+    return fetcher.get_scenarios()['scenario3']['compiled_data']
+
+
+def run(input_path, output_path, scenarios_path = None, chunk_size = 1000, workers = 1):
+    writer = tableWriter(output_path)
+    scenarios_writer = tableWriter(scenarios_path) if scenarios_path else None
+    pool = ProcessPoolExecutor(max_workers = workers, mp_context = jitKernels.pool_context()) if scenarios_path and workers != 1 else None
+    mapper = map if pool is None else pool.map
+
+    rows_done = 0
+    try:
+        for chunk in read_chunks(input_path, chunk_size):
+            chunk = chunk.reset_index(drop = True)
+            optimum = price_batch(chunk)
+            writer.write(pd.concat([chunk, optimum], axis = 1))
+
+            if scenarios_writer is not None:
+                # rows without any feasible point have no scenarios to tabulate
+                feasible = np.isfinite(optimum['cost_function'].to_numpy())
+                tables = mapper(scenario_table, chunk[feasible].to_dict(orient = 'records'))
+                for row, table in zip(rows_done + np.flatnonzero(feasible), tables):
+                    scenarios_writer.write(table.assign(row = row))
+
+            rows_done += len(chunk)
+    finally:
+        writer.close()
+        if scenarios_writer is not None:
+            scenarios_writer.close()
+        if pool is not None:
+            pool.shutdown()
+
+    return rows_done
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Price mortgage scenarios from a CSV or Parquet file.')
+    parser.add_argument('input', help = 'CSV or .parquet file with one column per financialEstimator argument')
+    parser.add_argument('output', help = 'CSV or .parquet file for the optimum of every row')
+    parser.add_argument('--scenarios', help = 'CSV or .parquet file for the scenario3 summary table of every row')
+    parser.add_argument('--chunk-size', type = int, default = 1000, help = 'rows read and priced at a time')
+    parser.add_argument('--workers', type = int, default = 1, help = 'processes for the scenario tables (0 = one per core)')
+    args = parser.parse_args(argv)
+
+    rows = run(
+            input_path = args.input,
+            output_path = args.output,
+            scenarios_path = args.scenarios,
+            chunk_size = args.chunk_size,
+            workers = args.workers or None
+            )
+    print(f'Priced {rows} rows into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
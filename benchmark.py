@@ -0,0 +1,375 @@
+"""Benchmark suite for the financial engine and the dashboard pipeline.
+
+    python benchmark.py                          # run and print every case
+    python benchmark.py --output results.json    # also write the run as JSON
+    python benchmark.py --save-baseline          # store the run in benchmarks/baseline.json
+    python benchmark.py --compare                # exit 1 if a case is slower than or missing from the baseline
+
+Every case prices the scenario in frontend/defaults.json and records wall
+time (min and median over the repeats), objective evaluations (where an
+optimizer runs) and peak traced memory. Import cases time cold imports of
+the dashboard and of dataFetcher in fresh interpreters instead.
+Baselines are machine specific: regenerate them on the machine you compare on.
+"""
+from backend import jitKernels
+from backend.evaluationCache import evaluationCache
+from backend.financialSim import financialEstimator, financialFunctions, searchResult
+from backend.monteCarlo import rateModel
+from backend.rateSchedule import rateSchedule
+from dataFetcher import dataFetcher
+import argparse
+import ast
+import itertools
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import scipy
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULTS_PATH = os.path.join(REPO_PATH, 'frontend', 'defaults.json')
+BASELINE_PATH = os.path.join(REPO_PATH, 'benchmarks', 'baseline.json')
+
+# dependencies that should only be imported once they are used
+HEAVY_MODULES = ('scipy', 'pandas', 'plotly', 'numba')
+
+
+def default_inputs():
+    with open(DEFAULTS_PATH, 'rb') as file:
+        defaults = json.load(file)
+    values = {key: spec['default'] for key, spec in defaults.items()}
+    return {
+        'rent_price_growth': values['RENT_GROWTH'],
+        'rent_price': values['RENT_PRICE'],
+        'house_price_growth': values['HOUSE_PRICE_GROWTH'],
+        'house_price': values['HOUSE_PRICE'],
+        'monthly_mortgage_interes': values['INTEREST'],
+        'intallment_threshold': values['INSTALLMENT_THRESH'],
+        'savings_per_month': values['SAVINGS_PER_MONTH'],
+        'etf_growth': values['SAVINGS_GROWTH'],
+        'initial_etf_savings': values['INITIAL_SAVINGS']
+    }
+
+
+def measure(name, run, repeat = 5, **params):
+    """Times `run` (which may return an evaluation count) `repeat` times and
+    traces its peak memory in one extra, untimed call."""
+    times = []
+    nfev = None
+    for _ in range(repeat):
+        np.random.seed(0)
+        start = time.perf_counter()
+        nfev = run()
+        times.append(time.perf_counter() - start)
+
+    np.random.seed(0)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'params': params,
+        'repeat': repeat,
+        'wall_time_min': min(times),
+        'wall_time_median': statistics.median(times),
+        'nfev': nfev,
+        'peak_memory_bytes': peak
+    }
+
+
+def evaluations(result, wrapper, optimizer):
+    # the wrapper counts every point DE prices, while a grid pass only records
+    # its reducing path on it and reports the cells it priced in nfev
+    return int(result.nfev) if optimizer == 'grid' else wrapper.num_calls
+
+
+def grid_cases(inputs):
+    for scale in (1, 2, 5, 10):
+        months_wait = np.arange(1, 40 * 12 * scale, dtype = int)
+        mortgage_years = np.arange(1, 30 * scale, dtype = int)
+
+        def run():
+            financialEstimator(**inputs).cost_grid(months_wait, mortgage_years)
+            return months_wait.size * mortgage_years.size
+
+        yield measure('cost_grid', run, grid_scale = scale, cells = months_wait.size * mortgage_years.size)
+
+
+def amortization_cases(inputs):
+    for years in (5, 15, 30):
+        def run():
+            financialFunctions.amortization_schedule(principal = inputs['house_price'], interest = inputs['monthly_mortgage_interes'], periods = years * 12)
+
+        yield measure('amortization_schedule', run, repeat = 20, mortgage_years = years)
+
+    principals = np.linspace(0.5, 1.5, 1000) * inputs['house_price']
+    def run_batch():
+        financialFunctions.amortization_schedule(principal = principals, interest = inputs['monthly_mortgage_interes'], periods = 30 * 12)
+
+    yield measure('amortization_schedule', run_batch, mortgage_years = 30, loans = principals.size)
+
+
+def objective_cases(inputs):
+    # uncached single-point objective, as the scalar DE path prices it,
+    # with the compiled kernels and with NumPy
+    points = np.random.default_rng(0).integers([1, 1], [481, 31], (2000, 2)).tolist()
+    for jit in ((True, False) if jitKernels.AVAILABLE else (False,)):
+        def run():
+            estimator = financialEstimator(**inputs)
+            for point in points:
+                estimator.objective_function(point)
+            return len(points)
+
+        enabled = jitKernels.ENABLED
+        jitKernels.enable(jit)
+        try:
+            yield measure('objective_function', run, repeat = 3, jit = jit)
+        finally:
+            jitKernels.enable(enabled)
+
+
+def optimizer_cases(inputs):
+    for label, kwargs in (('de', {}), ('de_vectorized', {'vectorized': True}), ('grid', {'optimizer': 'grid'})):
+        def run():
+            result, wrapper = financialEstimator(**inputs).run_simulation(**kwargs)
+            return evaluations(result, wrapper, kwargs.get('optimizer'))
+
+        yield measure('run_simulation', run, repeat = 3, optimizer = label)
+
+
+def scenario_cases(inputs):
+    estimator = financialEstimator(**inputs)
+    months_wait, mortgage_years, Z, reducing_steps = estimator.cost_grid()
+    sub_optimal = pd.DataFrame(reducing_steps, columns = ['steps', 'months_to_wait', 'mortgage_years', 'cost_function']).tail(5)
+
+    for years in (5, 15, 25, 29):
+        row = Z[years - 1]
+        if not np.isfinite(row).any():
+            continue
+        i = int(np.argmin(row))
+        opt_result = searchResult(x = np.array([months_wait[i], years], dtype = float), fun = row[i])
+
+        def run():
+            estimator.calculate_scenarios(opt_results_obj = opt_result, sub_optimal_df = sub_optimal.copy())
+
+        yield measure('calculate_scenarios', run, mortgage_years = years)
+
+
+def pipeline_cases(inputs):
+    for optimizer in ('grid', 'de'):
+        def run():
+            fetcher = dataFetcher(**inputs, optimizer = optimizer)
+            result, wrapper = fetcher.get_optimal_result()
+            fetcher.get_data_for_cost_plots()
+            fetcher.get_scenarios()
+            return evaluations(result, wrapper, optimizer)
+
+        yield measure('dataFetcher_pipeline', run, repeat = 3, optimizer = optimizer)
+
+    def run_sweep():
+        fetcher = dataFetcher(**inputs, optimizer = 'grid')
+        thresholds = [inputs['intallment_threshold'] + 500 * i for i in range(3)]
+        for variant in fetcher.sweep('installment_threshold', thresholds, workers = 1):
+            variant.get_scenarios()
+
+    yield measure('dataFetcher_sweep', run_sweep, repeat = 3, optimizer = 'grid', thresholds = 3)
+
+
+def incremental_cases(inputs):
+    # optimum and cost grid of a resubmit after editing one field, sharing the
+    # evaluation cache of the first submit; every repeat uses a new value so
+    # no whole surface is reused
+    for parameter in (None, 'rent_price', 'intallment_threshold', 'monthly_mortgage_interes'):
+        cache = evaluationCache()
+        dataFetcher(**inputs, optimizer = 'grid', cache = cache).get_cost_grid()
+        edits = itertools.count(1)
+
+        def run():
+            edited = dict(inputs)
+            if parameter is not None:
+                edited[parameter] = inputs[parameter] * (1 + 1e-3 * next(edits))
+            fetcher = dataFetcher(**edited, optimizer = 'grid', cache = None if parameter is None else cache)
+            fetcher.get_optimal_result()
+            fetcher.get_cost_grid()
+
+        yield measure('resubmit', run, repeat = 20, edited = parameter or 'cold')
+
+
+def schedule_cases(inputs):
+    # refixing after 1 and after 3 more years, around the flat rate
+    rate = inputs['monthly_mortgage_interes']
+    schedule = rateSchedule.refixing([0.8 * rate, 1.3 * rate, rate], [1, 3])
+    for scale in (1, 10):
+        months_wait = np.arange(1, 40 * 12 * scale, dtype = int)
+        mortgage_years = np.arange(1, 30 * scale, dtype = int)
+
+        def run():
+            financialEstimator(**inputs, mortgage_schedule = schedule).cost_grid(months_wait, mortgage_years)
+
+        yield measure('cost_grid_refixing', run, grid_scale = scale, cells = months_wait.size * mortgage_years.size)
+
+    def run_pipeline():
+        fetcher = dataFetcher(**inputs, optimizer = 'grid', mortgage_schedule = schedule)
+        fetcher.get_optimal_result()
+        fetcher.get_scenarios()
+
+    yield measure('dataFetcher_pipeline_refixing', run_pipeline, repeat = 3, optimizer = 'grid')
+
+
+def monte_carlo_cases(inputs):
+    models = {
+        'house_price_growth': rateModel('lognormal', volatility = 0.01),
+        'monthly_mortgage_interes': rateModel('ar1', volatility = 0.0003, persistence = 0.98)
+    }
+    for paths in (1000, 10000):
+        def run():
+            financialEstimator(**inputs).monte_carlo(models, paths = paths, seed = 0)
+
+        yield measure('monte_carlo', run, repeat = 1, paths = paths)
+
+
+def app_imports():
+    """Module-level imports of the dashboard script, but streamlit's own."""
+    with open(os.path.join(REPO_PATH, 'streamlit.py')) as file:
+        tree = ast.parse(file.read())
+    statements = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module]
+        else:
+            continue
+        if not any(module.split('.')[0] == 'streamlit' for module in modules):
+            statements.append(ast.unparse(node))
+    return statements
+
+
+def cold_import(statements, traced = False):
+    """Runs the import `statements` in a fresh interpreter and returns the
+    seconds they took, their peak traced memory (when `traced`) and which
+    of HEAVY_MODULES they loaded."""
+    code = '\n'.join([
+        'import json, sys, time, tracemalloc',
+        'tracemalloc.start()' if traced else '',
+        'start = time.perf_counter()',
+        *statements,
+        'seconds = time.perf_counter() - start',
+        'peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0',
+        f'print(json.dumps({{"seconds": seconds, "peak": peak, "loaded": [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))'
+    ])
+    output = subprocess.run([sys.executable, '-c', code], cwd = REPO_PATH, capture_output = True, text = True, check = True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def import_cases(inputs, repeat = 5):
+    # the script as it renders the form, then what its first submission adds
+    cases = (
+        ('dataFetcher', ['from dataFetcher import dataFetcher']),
+        ('app', app_imports()),
+        ('app_submission', app_imports() + ['from frontend.plotsHelpers import plotters', 'from dataFetcher import dataFetcher'])
+    )
+    for target, statements in cases:
+        times = [cold_import(statements)['seconds'] for _ in range(repeat)]
+        traced = cold_import(statements, traced = True)
+        yield {
+            'name': 'cold_import',
+            'params': {'target': target},
+            'repeat': repeat,
+            'wall_time_min': min(times),
+            'wall_time_median': statistics.median(times),
+            'nfev': None,
+            'peak_memory_bytes': traced['peak'],
+            'heavy_modules': traced['loaded']
+        }
+
+
+SUITES = [import_cases, amortization_cases, grid_cases, objective_cases, optimizer_cases, scenario_cases, pipeline_cases, incremental_cases, schedule_cases, monte_carlo_cases]
+
+
+def run_suite():
+    inputs = default_inputs()
+    results = []
+    for suite in SUITES:
+        results.extend(suite(inputs))
+
+    return {
+        'meta': {
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'pandas': pd.__version__,
+            'jit': jitKernels.ENABLED,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'inputs': inputs
+        },
+        'results': results
+    }
+
+
+def case_key(result):
+    return result['name'] + ''.join(f'[{k}={v}]' for k, v in sorted(result['params'].items()))
+
+
+def compare(run, baseline, threshold):
+    """Cases whose best time is more than `threshold` (relative) slower
+    than the baseline, as (key, baseline seconds, current seconds), and the
+    keys of the cases the baseline has no entry for."""
+    reference = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    missing = []
+    for result in run['results']:
+        key = case_key(result)
+        if key not in reference:
+            missing.append(key)
+        elif result['wall_time_min'] > reference[key]['wall_time_min'] * (1 + threshold):
+            regressions.append((key, reference[key]['wall_time_min'], result['wall_time_min']))
+    return regressions, missing
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the financial engine and dashboard pipeline.')
+    parser.add_argument('--output', help = 'write the run as JSON to this path')
+    parser.add_argument('--save-baseline', action = 'store_true', help = f'store the run as {BASELINE_PATH}')
+    parser.add_argument('--compare', action = 'store_true', help = 'compare against the stored baseline')
+    parser.add_argument('--baseline', default = BASELINE_PATH, help = 'baseline JSON to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.25, help = 'allowed relative slowdown before a case fails')
+    args = parser.parse_args(argv)
+
+    run = run_suite()
+    for result in run['results']:
+        print(f"{case_key(result):70s} {result['wall_time_min'] * 1e3:10.3f} ms  nfev={result['nfev']}  peak={result['peak_memory_bytes'] / 2**20:.1f} MiB")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(run, file, indent = 2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok = True)
+        with open(args.baseline, 'w') as file:
+            json.dump(run, file, indent = 2)
+
+    if args.compare:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions, missing = compare(run, baseline, args.threshold)
+        for key, before, after in regressions:
+            print(f'REGRESSION {key}: {before * 1e3:.3f} ms -> {after * 1e3:.3f} ms')
+        for key in missing:
+            print(f'MISSING {key}: not in the baseline, regenerate it with --save-baseline')
+        if regressions or missing:
+            sys.exit(1)
+        print('No regressions over the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 from backend.financialSim import financialEstimator   
-import pandas as pd
+from backend import jitKernels
+from backend.callBacksWrapper import Simulator
+from backend.instrumentation import TRACER, traced
+from backend.costSurface import costSurface
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import os
 
 
 class dataFetcher(financialEstimator):
@@ -15,7 +20,14 @@ class dataFetcher(financialEstimator):
         intallment_threshold,
         savings_per_month,
         etf_growth,
-        initial_etf_savings
+        initial_etf_savings,
+        optimizer = 'de',
+        cache = None,
+        surface_dtype = 'float64',
+        surface_storage = 'dense',
+        mortgage_schedule = None,
+        progress = None,
+        progress_interval = 1.
         ):
 
         super().__init__(
@@ -27,45 +39,138 @@ class dataFetcher(financialEstimator):
                     intallment_threshold = intallment_threshold,
                     savings_per_month = savings_per_month,
                     etf_growth = etf_growth,
-                    initial_etf_savings = initial_etf_savings
+                    initial_etf_savings = initial_etf_savings,
+                    optimizer = optimizer,
+                    cache = cache,
+                    surface_dtype = surface_dtype,
+                    surface_storage = surface_storage,
+                    mortgage_schedule = mortgage_schedule
                         )
 
-        self.__opt_result = None
-        self.__opt_verbose = None
-        self.__all_sub_optimal = None
+        self.progress = progress # optional sink for the optimizer's iteration lines, see run_simulation
+        self.progress_interval = progress_interval # minimum seconds between two of them
+        self.__stages = {} # stage name -> (inputs key it was computed for, value)
+        self.__stage_log = [] # (stage name, 'computed' | 'reused') in call order
+
+    # stage -> stages whose output it was built from
+    STAGE_DEPENDENCIES = {
+        'optimization': (),
+        'grid': (),
+        'sub_optimal': ('optimization', 'grid'),
+        'scenarios': ('optimization', 'sub_optimal'),
+    }
 
     @property
     def opt_result(self):
-        return self.__opt_result
+        return self.__stage_value('optimization', 0)
         
     @property
     def opt_verbose(self):
-        self.__opt_verbose
+        return self.__stage_value('optimization', 1)
 
     @property
     def all_sub_optimal(self):
-        self.__all_sub_optimal
+        return self.__stage_value('sub_optimal')
+
+    @property
+    def stage_log(self):
+        return list(self.__stage_log)
+
+    @property
+    def stage_status(self):
+        """Last outcome of every stage touched so far: 'computed' or 'reused'."""
+        return dict(self.__stage_log)
+
+    @property
+    def inputs_key(self):
+        return (self.params_key, self.optimizer, tuple(self.bounds))
+
+    def __stage_value(self, stage, item = None):
+        if stage not in self.__stages:
+            return None
+        value = self.__stages[stage][1]
+        return value if item is None else value[item]
+
+    def invalidate(self, stage = None):
+        """Drops a stage (all of them by default) and every stage built on it."""
+        stages = list(dataFetcher.STAGE_DEPENDENCIES) if stage is None else [stage]
+        for name in stages:
+            self.__stages.pop(name, None)
+            for dependent, dependencies in dataFetcher.STAGE_DEPENDENCIES.items():
+                if name in dependencies:
+                    self.invalidate(dependent)
+
+    def _stage(self, stage, compute):
+        """Returns the stage output, computing it only if it is missing or
+        was computed for different inputs."""
+        inputs_key = self.inputs_key
+        if stage in self.__stages:
+            if self.__stages[stage][0] == inputs_key:
+                self.__stage_log.append((stage, 'reused'))
+                TRACER.count(f'stage.{stage}.reused')
+                return self.__stages[stage][1]
+            self.invalidate(stage)
+
+        with TRACER.span(f'stage.{stage}', installment_threshold = self.installment_threshold, optimizer = self.optimizer):
+            value = compute()
+        self.__stages[stage] = (inputs_key, value)
+        self.__stage_log.append((stage, 'computed'))
+        return value
+
+
+    def export_stages(self):
+        """Plain-data copy of the computed stages (optimizer result, improving
+        steps, cost grid, sub-optimal frame and scenarios) for `resultCache`."""
+        stages = {name: value for name, (inputs_key, value) in self.__stages.items() if inputs_key == self.inputs_key}
+        if 'optimization' in stages:
+            opt_result, opt_verbose = stages['optimization']
+            stages['optimization'] = (opt_result, opt_verbose.decreasing_list_calls_inp, opt_verbose.decreasing_list_calls_res)
+        return stages
+
+    def load_stages(self, stages):
+        """Seeds the stages from `export_stages` output computed for the same inputs."""
+        for name, value in stages.items():
+            if name == 'optimization':
+                opt_result, steps_inp, steps_res = value
+                opt_verbose = Simulator(self.objective_function)
+                opt_verbose.record_batch(steps_inp, steps_res)
+                value = (opt_result, opt_verbose)
+            elif name == 'grid':
+                if isinstance(value, tuple):
+                    # stages exported before the grid was kept as a costSurface
+                    months_wait, mortgage_years, Z, reducing_steps = value
+                    value = costSurface(months_wait, mortgage_years, Z, steps = reducing_steps, params = self.params_key)
+                self.grid_surface = value
+            self.__stages[name] = (self.inputs_key, value)
 
 
     def get_optimal_result(self):
-        self.__opt_result, self.__opt_verbose = self.run_simulation()
-        print('Optimal result found: ', self.__opt_result)
-        # Print the results
-        print("Optimal solution:", self.__opt_result.x)
-        print("Optimal value of the objective function:", self.__opt_result.fun)
-        return self.opt_result, self.opt_verbose
+        return self._stage('optimization', self.__compute_optimal_result)
+
+    def __compute_optimal_result(self):
+        with TRACER.span('optimal_result') as tags:
+            opt_result, opt_verbose = self.run_simulation(progress = self.progress, progress_interval = self.progress_interval)
+            tags.update(x = opt_result.x.tolist(), fun = float(opt_result.fun), nfev = int(opt_result.nfev))
+        return opt_result, opt_verbose
+
+
+    def get_cost_grid(self):
+        return self._stage('grid', self.cost_surface).as_tuple()
 
 
     def get_result_dataframe(self):
-        # if type(self.__opt_result) == type(None):
+        return self._stage('sub_optimal', self.__compute_result_dataframe)
+
+    def __compute_result_dataframe(self):
+        import pandas as pd
         opt_result, opt_verbose = self.get_optimal_result()
 
-        sub_opt_steps = pd.DataFrame(self.__opt_verbose.decreasing_list_calls_inp, columns = ['months_to_wait', 'mortgage_years'])
-        sub_opt_steps['cost_function'] = self.__opt_verbose.decreasing_list_calls_res
+        sub_opt_steps = pd.DataFrame(opt_verbose.decreasing_list_calls_inp, columns = ['months_to_wait', 'mortgage_years'], copy = False)
+        sub_opt_steps['cost_function'] = opt_verbose.decreasing_list_calls_res
 
-        _ = self.cost_grid()
+        _, _, _, reducing_steps = self.get_cost_grid()
 
-        sub_optimal_grid = pd.DataFrame(self.reducing_steps, columns = ['steps', 'months_to_wait', 'mortgage_years', 'cost_function'])
+        sub_optimal_grid = pd.DataFrame(reducing_steps, columns = ['steps', 'months_to_wait', 'mortgage_years', 'cost_function'])
         # sub_optimal_grid.head(10)
         # sub_optimal_grid.iloc[-1 ,:]
         # to_append = sub_optimal_grid.tail(20).head(5)
@@ -83,24 +188,90 @@ class dataFetcher(financialEstimator):
         
         # all_sub_optimal = sub_opt_steps[sub_opt_steps['cost_function'] != np.inf].tail(5).head(4).copy()
 
-        all_sub_optimal.sort_values(by = 'cost_function', inplace = True)
+        # the grid search steps and the sample both come from the reducing path, keep each point once
+        all_sub_optimal = all_sub_optimal[~all_sub_optimal[['months_to_wait', 'mortgage_years']].round().duplicated()].sort_values(by = 'cost_function')
 
         all_sub_optimal.reset_index(drop = True, inplace = True)
 
-        self.__all_sub_optimal = all_sub_optimal
-
         return all_sub_optimal
 
 
     def get_data_for_cost_plots(self):
-        if type(self.__all_sub_optimal) == type(None):
-            self.get_result_dataframe()
-        return self.months_wait, self.mortgage_years, self.Z
+        months_wait, mortgage_years, Z, _ = self.get_cost_grid()
+        return months_wait, mortgage_years, Z
 
     def get_scenarios(self):
-        if type(self.__all_sub_optimal) == type(None):
-            self.get_result_dataframe()
-        scenarios_results = self.calculate_scenarios(opt_results_obj = self.__opt_result, sub_optimal_df = self.__all_sub_optimal)
-        return scenarios_results
+        return self._stage('scenarios', self.__compute_scenarios)
+
+    def __compute_scenarios(self):
+        opt_result, _ = self.get_optimal_result()
+        return self.calculate_scenarios(opt_results_obj = opt_result, sub_optimal_df = self.get_result_dataframe().copy())
+
+
+    def trace_report(self, path = None):
+        """JSON report of the TRACER spans and counters, with this fetcher's
+        evaluation cache statistics; written to `path` when given."""
+        return TRACER.to_json(path = path, counters = {f'evaluation_cache.{k}': v for k, v in self.cache.stats().items()})
+
+
+    @traced('sweep')
+    def sweep(self, parameter, values, workers = None, cached = None):
+        """Computes every stage for copies of this fetcher that only differ in
+        `parameter`, an estimator attribute such as 'installment_threshold'
+        (or the constructor argument it comes from).
+
+        A threshold sweep prices the cost components once and re-masks them
+        per value; the remaining stages run on a process pool of `workers`
+        (one per core by default, 1 keeps everything in-process). `cached`
+        may hold `export_stages` output per value, those are only loaded."""
+        attributes = sorted(financialEstimator.ARGUMENT_ATTRIBUTES.get(name, name) for name in self.init_kwargs)
+        parameter = financialEstimator.ARGUMENT_ATTRIBUTES.get(parameter, parameter)
+        if parameter not in attributes:
+            raise ValueError(f"Unknown parameter '{parameter}', expected one of {attributes}")
+        cached = [None] * len(values) if cached is None else cached
+
+        fetchers = []
+        for value, stages in zip(values, cached):
+            fetcher = dataFetcher(**self.init_kwargs, cache = self.cache, progress = self.progress, progress_interval = self.progress_interval)
+            setattr(fetcher, parameter, value)
+            if stages is not None:
+                fetcher.load_stages(stages)
+            fetchers.append(fetcher)
+
+        pending = [fetcher for fetcher, stages in zip(fetchers, cached) if stages is None]
+        if not pending:
+            return fetchers
+
+        if parameter == 'installment_threshold':
+            months_wait, mortgage_years = self.search_axes()
+            surfaces = self.threshold_surfaces([fetcher.installment_threshold for fetcher in pending], months_wait, mortgage_years)
+            for fetcher, Z in zip(pending, surfaces):
+                fetcher.cache.put_surface(fetcher.params_key, fetcher.compact_surface(months_wait, mortgage_years, Z))
+                fetcher.get_cost_grid()
+                if fetcher.optimizer == 'grid':
+                    fetcher.get_optimal_result()
+
+        if workers == 1 or len(pending) == 1:
+            for fetcher in pending:
+                fetcher.get_scenarios()
+        else:
+            workers = min(len(pending), workers or os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers = workers, mp_context = jitKernels.pool_context()) as pool:
+                results = pool.map(
+                            _complete_stages, 
+                            [fetcher.init_kwargs for fetcher in pending], 
+                            [fetcher.export_stages() for fetcher in pending]
+                            )
+                for fetcher, stages in zip(pending, results):
+                    fetcher.load_stages(stages)
+
+        return fetchers
 
 
+def _complete_stages(init_kwargs, stages):
+    # process-pool entry point for dataFetcher.sweep
+    fetcher = dataFetcher(**init_kwargs)
+    fetcher.load_stages(stages)
+    fetcher.get_cost_grid()
+    fetcher.get_scenarios()
+    return fetcher.export_stages()
@@ -1,6 +1,7 @@
 import plotly.graph_objects as go
 import numpy as np
 from plotly.subplots import make_subplots
+from backend.instrumentation import traced
 
 
 # some brute force editing
@@ -10,25 +11,94 @@ for l in keys:
         locals()[l].update_layout(font_color = '#fffafa')
 
 
+# shared by every figure built in light mode: a few layout defaults instead
+# of the full default template that is otherwise serialized into each figure
+LIGHT_TEMPLATE = go.layout.Template(layout = dict(
+    height = 400,
+    width = 400,
+    title_x = 0,
+    title_y = 0.95,
+    hovermode = 'x unified',
+    colorway = ['#2794f5', '#ef553b', '#00cc96', '#ab63fa', '#ffa15a'],
+))
+
+SURFACE_HOVER = 'Months to wait: %{x}<br>Mortgage years: %{y}<br>Total cost: %{z:,.2f}<extra></extra>'
+
+
+def sample_indices(n, target, keep = None):
+    """At most `target` evenly spread indices of range(n), ends and `keep` included."""
+    if target is None or n <= target:
+        return np.arange(n)
+    indices = np.linspace(0, n - 1, target).round().astype(int)
+    if keep is not None:
+        indices = np.append(indices, keep)
+    return np.unique(indices)
+
+
+def curve_points(periods, costs, start, target = 100):
+    """(periods, costs) of a cost curve cut down to about `target` points,
+    keeping the ends and the purchase month `start`, where its slope changes.
+    The curves are piecewise smooth, so the decimated line looks the same."""
+    costs = np.asarray(costs)
+    periods = np.asarray(periods)[:len(costs)]
+    keep = min(int(np.searchsorted(periods, start)), len(costs) - 1)
+    indices = sample_indices(len(costs), target, keep = keep)
+    return periods[indices], costs[indices]
+
+
+def nan_joined(segments, dtype = np.float64):
+    """Concatenates 1-d segments with a NaN between them, so that many
+    lines travel as a single trace. Month axes fit float32 exactly, which
+    halves their payload."""
+    parts = []
+    for segment in segments:
+        parts.extend([np.asarray(segment, dtype = dtype), np.full(1, np.nan, dtype = dtype)])
+    return np.concatenate(parts[:-1]) if parts else np.empty(0, dtype = dtype)
+
+
 class plotters:
+    """Figure builders for the dashboard. With `light = True` the surface
+    figures are decimated to at most `resolution` (months, years) points,
+    carry a hovertemplate instead of per-cell text and use LIGHT_TEMPLATE;
+    the static builders take the same `light` flag."""
 
-    def __init__(self, X, Y, Z):
+    def __init__(self, X, Y, Z, light = False, resolution = (160, 30)):
         self.Z = Z
         self.X = X
         self.Y = Y
+        self.light = light
+        self.resolution = resolution
+
+    def surface_sample(self):
+        """(X, Y, Z) as plotted: decimated in light mode, keeping the cheapest cell."""
+        if not self.light:
+            return self.X, self.Y, self.Z
+        Z = np.asarray(self.Z)
+        j, i = np.unravel_index(np.argmin(Z), Z.shape)
+        columns = sample_indices(Z.shape[1], self.resolution[0], i)
+        rows = sample_indices(Z.shape[0], self.resolution[1], j)
+        return np.asarray(self.X)[columns], np.asarray(self.Y)[rows], Z[np.ix_(rows, columns)]
     
     
+    @traced('plot.continuous_heatmap')
     def continuous_heatmap(self, show = False):
 
-        # Example with annotations
+        X, Y, Z = self.surface_sample()
+        if self.light:
+            labels = dict(hovertemplate = SURFACE_HOVER)
+        else:
+            labels = dict(text = np.around(Z, decimals = 2)) # Rounded values as annotations
+
         fig = go.Figure(data=go.Heatmap(
-                        z = self.Z,
-                        x = self.X,
-                        y = self.Y,
+                        z = Z,
+                        x = X,
+                        y = Y,
                         colorscale = 'Viridis',
                         colorbar = dict(title = 'Total Cost'),
-                        text=np.around(self.Z, decimals = 2))
-                        )  # Rounded values as annotations
+                        **labels)
+                        )
+        if self.light:
+            fig.update_layout(template = LIGHT_TEMPLATE)
 
         fig.update_layout(
             title='Total Cost Mortgage Over Simulation Grid',
@@ -50,17 +120,28 @@ class plotters:
         return fig
 
 
+    @traced('plot.cost_3d')
     def cost_3d(self, show = False):
     
-        X, Y = np.meshgrid(self.X, self.Y)
+        if self.light:
+            # a surface takes the 1-d axes as well, no need to ship the meshgrid
+            X, Y, Z = self.surface_sample()
+            labels = dict(hovertemplate = SURFACE_HOVER)
+        else:
+            X, Y = np.meshgrid(self.X, self.Y)
+            Z = self.Z
+            labels = {}
 
         # Create surface plot figure
         fig2 = go.Figure(data=[go.Surface(
-                            z = self.Z,
+                            z = Z,
                             x = X,
                             y = Y,
-                            colorscale = 'Viridis'
+                            colorscale = 'Viridis',
+                            **labels
                             )])
+        if self.light:
+            fig2.update_layout(template = LIGHT_TEMPLATE)
 
         # Update layout properties
         fig2.update_layout(
@@ -90,12 +171,16 @@ class plotters:
         
     
     @staticmethod
-    def scenerio_comp_plot(total_periods, suboptimal_cost_arr, optimal_cost_arr, month_start_optimal, show = True):
+    @traced('plot.scenerio_comp_plot')
+    def scenerio_comp_plot(total_periods, suboptimal_cost_arr, optimal_cost_arr, month_start_optimal, show = True, light = False):
 
         max_cost = max([i[1][-1] for i in suboptimal_cost_arr])
 
         fig = go.Figure()
 
+        if light:
+            return plotters.__light_comp_plot(fig, total_periods, suboptimal_cost_arr, optimal_cost_arr, month_start_optimal, max_cost, show)
+
         for i, tup in enumerate(suboptimal_cost_arr):
 
             color = f'rgba({39 + i * 10}, 148, 245, 0.5)'
@@ -115,7 +200,7 @@ class plotters:
             )
 
 
-        fig.add_trace(go.Scatter(x=total_periods[:len(optimal_cost_arr)], y = optimal_cost_arr, name='Optimal', line=dict(color=f'rgba(39, 148, 245, 1)')))
+        fig.add_trace(go.Scatter(x=total_periods[:len(optimal_cost_arr)], y = optimal_cost_arr, name='Optimal', line=dict(color='rgba(39, 148, 245, 1)')))
 
         fig.add_shape(
                 type="line",
@@ -159,11 +244,54 @@ class plotters:
             fig.show()
 
         return fig
+
+    @staticmethod
+    def __light_comp_plot(fig, total_periods, suboptimal_cost_arr, optimal_cost_arr, month_start_optimal, max_cost, show):
+        # every decimated suboptimal curve in one NaN-separated trace and every
+        # start marker in another, instead of a full trace and a shape per scenario
+        curves = [curve_points(total_periods, tup[1], tup[0]) for tup in suboptimal_cost_arr]
+        fig.add_trace(go.Scatter(
+                        x = nan_joined((periods for periods, _ in curves), dtype = np.float32),
+                        y = nan_joined(costs for _, costs in curves),
+                        name = 'suboptimal', 
+                        line = dict(color = 'rgba(39, 148, 245, 0.5)', dash = 'dash')
+                        ))
+        periods, costs = curve_points(total_periods, optimal_cost_arr, month_start_optimal)
+        fig.add_trace(go.Scatter(x = periods.astype(np.float32), y = costs, name = 'Optimal', line = dict(color = 'rgba(39, 148, 245, 1)')))
+
+        starts = [tup[0] for tup in suboptimal_cost_arr] + [month_start_optimal]
+        fig.add_trace(go.Scatter(
+                        x = nan_joined(([start, start] for start in starts), dtype = np.float32),
+                        y = nan_joined([0, max_cost * 1.05] for _ in starts),
+                        mode = 'lines',
+                        line = dict(color = 'rgba(39, 148, 245, 0.5)', width = 1),
+                        hoverinfo = 'skip',
+                        showlegend = False
+                        ))
+
+        fig.update_layout(
+            template = LIGHT_TEMPLATE,
+            title='Optimal vs Suboptimal Mortgage Scenarios Total Cost',
+            xaxis_title='Months',
+            yaxis_title='Cost',
+            legend = {
+                'orientation': "h",
+                'x': 0.1,
+                'y': -1.2,                
+                },
+            hoversubplots = 'axis',
+        )
+
+        if show:
+            fig.show()
+
+        return fig
     
 
 
     @staticmethod
-    def scenerio_grid_plot(total_periods, interest_payments, rent_prices, month_start_optimal, house_prices, saved_amounts, show = True):
+    @traced('plot.scenerio_grid_plot')
+    def scenerio_grid_plot(total_periods, interest_payments, rent_prices, month_start_optimal, house_prices, saved_amounts, show = True, light = False):
 
         max_step = total_periods[-1]
         padding_nan = np.repeat(np.nan, len(total_periods) - len(interest_payments))
@@ -281,6 +409,10 @@ class plotters:
 
         
 
+        if light:
+            fig1.update_layout(template = LIGHT_TEMPLATE)
+            fig2.update_layout(template = LIGHT_TEMPLATE)
+
         if show:
             fig1.show()
             fig2.show()
@@ -290,7 +422,8 @@ class plotters:
 
 
     @staticmethod
-    def future_savings_house_plot(starting_point, savings_scenario_arr, house_scenario_arr, show = True):
+    @traced('plot.future_savings_house_plot')
+    def future_savings_house_plot(starting_point, savings_scenario_arr, house_scenario_arr, show = True, light = False):
         
         future_steps = np.arange(starting_point, starting_point + len(savings_scenario_arr), dtype = int)
 
@@ -334,6 +467,9 @@ class plotters:
         fig.update_traces(marker_line_color='#FFFFFF', marker_line_width=1.5,
                   opacity=1)
 
+        if light:
+            fig.update_layout(template = LIGHT_TEMPLATE)
+
         if show:
             # Show plot
             fig.show()
@@ -342,7 +478,8 @@ class plotters:
 
 
     @staticmethod
-    def plot_table(data, show = False):
+    @traced('plot.plot_table')
+    def plot_table(data, show = False, light = False):
         headerColor = 'grey'
         rowEvenColor = 'lightgrey'
         rowOddColor = 'white'
@@ -376,6 +513,9 @@ class plotters:
             legend_title_font_color="rgba(255, 255, 255, 100)",
             
         )
+
+        if light:
+            fig.update_layout(template = LIGHT_TEMPLATE)
         
         if show:
             fig.show()
@@ -1,13 +1,17 @@
 import numpy as np
-import pandas as pd
 import re
 
-from frontend.plotsHelpers import plotters
-from dataFetcher import dataFetcher
-
 import streamlit as st
 import streamlit.components.v1 as components
+import functools
 import json
+import os
+import threading
+
+from backend.resultCache import resultCache
+from backend.jobRunner import jobRunner
+from backend.evaluationCache import evaluationCache
+from backend.instrumentation import TRACER
 
 
 
@@ -25,6 +29,17 @@ st.set_page_config(
     page_title="Mortgage Calculator", page_icon=":moneybag:", initial_sidebar_state="collapsed"
 )
 
+@st.cache_resource
+def get_result_cache():
+    # shared by every session of this server; set MORTGAGE_CACHE_DIR to also keep results on disk
+    return resultCache(directory = os.environ.get('MORTGAGE_CACHE_DIR'))
+
+@st.cache_resource
+def get_job_runner():
+    # one pool for every session; MORTGAGE_JOB_WORKERS sets its size
+    return jobRunner(max_workers = int(os.environ.get('MORTGAGE_JOB_WORKERS', 4)))
+
+
 # @st.cache_resource
 # def local_css(file_name):
 #     with open(file_name) as f:
@@ -63,91 +78,129 @@ with sidebar:
         
         submit = st.form_submit_button('Simulate')
 
-if not submit:
-    # if False:
-    st.title('Welcome to the Mortgage Simulator')
-    st.text('Please open the side bar and submit your values to simulate...')
-
-else:
-
-    increments = 500
-    opt_result = []
-    heat_plot = []
-    plot_3d = []
-    scenarios_plot = []
-    cost_anal_plot = []
-    saving_mortgages_comp_plot = []
-    table_plot = []
-
-    for i in range(3):
-    
-        calculator = dataFetcher( 
-                rent_price_growth = form_values['RENT_GROWTH'],
-                rent_price = form_values['RENT_PRICE'],
-                house_price_growth = form_values['HOUSE_PRICE_GROWTH'],
-                house_price = form_values['HOUSE_PRICE'],
-                monthly_mortgage_interes = form_values['INTEREST'],
-                intallment_threshold = form_values['INSTALLMENT_THRESH'] + increments * i,
-                savings_per_month = form_values['SAVINGS_PER_MONTH'],
-                etf_growth = form_values['SAVINGS_GROWTH'],
-                initial_etf_savings = form_values['INITIAL_SAVINGS']
-                )
-
-
-        opt_result.append(calculator.get_optimal_result()[0])
-
-        X, Y, Z = calculator.get_data_for_cost_plots()
-        plots = plotters(X = X, Y = Y, Z = Z)
-
-        heat_plot.append(plots.continuous_heatmap(show = False))
-        plot_3d.append(plots.cost_3d(show = False))
-
-        scenarios_results = calculator.get_scenarios()
-
-        scenario_1 = scenarios_results['scenario1']
-        scenarios_plot.append(plots.scenerio_comp_plot(
-                        total_periods = scenario_1['sub_total_periods_arr'], 
-                        suboptimal_cost_arr = scenario_1['suboptimal_cost_arr'], 
-                        optimal_cost_arr = scenario_1['optimal_cumcost'], 
-                        month_start_optimal = scenario_1['months_to_wait_opt'],
-                        show = False
-                        )
+def sweep_thresholds(form_values, thresholds, evaluation_cache, evaluation_lock, result_cache):
+    """Optimum, cost plot data and scenarios of each of `thresholds`; runs
+    on the job pool, so it must not call streamlit."""
+    from dataFetcher import dataFetcher
+
+    base_calculator = dataFetcher( 
+            rent_price_growth = form_values['RENT_GROWTH'],
+            rent_price = form_values['RENT_PRICE'],
+            house_price_growth = form_values['HOUSE_PRICE_GROWTH'],
+            house_price = form_values['HOUSE_PRICE'],
+            monthly_mortgage_interes = form_values['INTEREST'],
+            intallment_threshold = form_values['INSTALLMENT_THRESH'],
+            savings_per_month = form_values['SAVINGS_PER_MONTH'],
+            etf_growth = form_values['SAVINGS_GROWTH'],
+            initial_etf_savings = form_values['INITIAL_SAVINGS'],
+            optimizer = 'grid',
+            cache = evaluation_cache
+            )
+
+    result_keys = [resultCache.make_key(form_values, threshold, optimizer = base_calculator.optimizer) for threshold in thresholds]
+    cached_stages = [result_cache.get(key) for key in result_keys]
+
+    # the session's evaluation cache is shared with any other job of the session;
+    # with the grid optimizer the per-threshold work left after the shared
+    # surface is a few milliseconds, cheaper in-process than on a pool
+    with evaluation_lock:
+        calculators = base_calculator.sweep('installment_threshold', thresholds, workers = 1, cached = cached_stages)
+        results = [(calculator.get_optimal_result()[0], calculator.get_data_for_cost_plots(), calculator.get_scenarios())
+                   for calculator in calculators]
+
+    for key, stages, calculator in zip(result_keys, cached_stages, calculators):
+        if stages is None:
+            result_cache.put(key, calculator.export_stages())
+    return results
+
+
+def price_scenario(sweep, threshold, n):
+    """Figures of the `n`th threshold of `sweep`, a `sweep_thresholds` call
+    shared by the steps of the job; runs on the job pool, so it must not
+    call streamlit."""
+    # imported on the first submission, so the form renders without loading plotly
+    from frontend.plotsHelpers import plotters
+
+    opt_result, (X, Y, Z), scenarios_results = sweep()[n]
+
+    # decimated surfaces, hovertemplates and batched traces keep the payload small
+    plots = plotters(X = X, Y = Y, Z = Z, light = True)
+    scenario = {'threshold': threshold, 'opt_result': opt_result, 'heat_plot': plots.continuous_heatmap(show = False)}
+    if n == 0:
+        # the 3D surface and the savings comparison are only shown for the submitted scenario
+        scenario['plot_3d'] = plots.cost_3d(show = False)
+
+    scenario_1 = scenarios_results['scenario1']
+    scenario['scenarios_plot'] = plots.scenerio_comp_plot(
+                    total_periods = scenario_1['sub_total_periods_arr'], 
+                    suboptimal_cost_arr = scenario_1['suboptimal_cost_arr'], 
+                    optimal_cost_arr = scenario_1['optimal_cumcost'], 
+                    month_start_optimal = scenario_1['months_to_wait_opt'],
+                    show = False,
+                    light = True
                     )
-        
 
-        scenario_4 = scenarios_results['scenario4']
-
-        iter_cost_plt1, iter_cost_plt2 = plots.scenerio_grid_plot(
-                        total_periods = scenario_4['total_periods'], 
-                        interest_payments = scenario_4['interest_payments'], 
-                        rent_prices = scenario_4['rent_prices'],
-                        month_start_optimal = scenario_4['months_to_wait'], 
-                        house_prices = scenario_4['house_prices'], 
-                        saved_amounts = scenario_4['saved_amounts'], 
-                        show = False
-                        )
-
-        cost_anal_plot.append([iter_cost_plt1, iter_cost_plt2])
-
-
-        scenario_2 = scenarios_results['scenario2']
-        starting_point = scenario_4['total_periods'][-1] + 1
+    scenario_4 = scenarios_results['scenario4']
+    scenario['cost_anal_plot'] = plots.scenerio_grid_plot(
+                    total_periods = scenario_4['total_periods'], 
+                    interest_payments = scenario_4['interest_payments'], 
+                    rent_prices = scenario_4['rent_prices'],
+                    month_start_optimal = scenario_4['months_to_wait'], 
+                    house_prices = scenario_4['house_prices'], 
+                    saved_amounts = scenario_4['saved_amounts'], 
+                    show = False,
+                    light = True
+                    )
 
+    scenario_2 = scenarios_results['scenario2']
+    starting_point = scenario_4['total_periods'][-1] + 1
 
-        saving_mortgages_comp_plot.append(plots.future_savings_house_plot(
+    if n == 0:
+        scenario['saving_mortgages_comp_plot'] = plots.future_savings_house_plot(
                             starting_point = starting_point, 
                             savings_scenario_arr = scenario_2['savings_scenario_arr'], 
                             house_scenario_arr = scenario_2['house_scenario_arr'], 
-                            show = False
+                            show = False,
+                            light = True
                             )
-                    )
 
-        results_data = scenarios_results['scenario3']['compiled_data'].sort_values(by = ['cost_function', 'months_to_wait', 'mortgage_years'], ascending = True)
-        results_data.columns = [re.sub('_', '<br>', i) for i in results_data.columns]
+    results_data = scenarios_results['scenario3']['compiled_data'].sort_values(by = ['cost_function', 'months_to_wait', 'mortgage_years'], ascending = True)
+    results_data.columns = [re.sub('_', '<br>', i) for i in results_data.columns]
+    scenario['table_plot'] = plots.plot_table(results_data, light = True)
 
-        table_plot.append(plots.plot_table(results_data))
+    return scenario
 
 
+if submit:
+    increments = 500
+    # kept for the session, so a resubmit after editing one field only
+    # reprices the cost components that depend on it
+    if 'evaluation_cache' not in st.session_state:
+        st.session_state['evaluation_cache'] = evaluationCache()
+    if 'evaluation_lock' not in st.session_state:
+        st.session_state['evaluation_lock'] = threading.Lock()
+
+    thresholds = [form_values['INSTALLMENT_THRESH'] + increments * i for i in range(3)]
+    job_key = resultCache.make_key(form_values, form_values['INSTALLMENT_THRESH'], optimizer = 'grid', increments = increments)
+    # the first step sweeps every threshold at once, then the figures are built
+    # in order on the shared pool, the submitted scenario first; an identical
+    # submission still in flight (from any session) is joined instead
+    sweep = functools.cache(functools.partial(sweep_thresholds, dict(form_values), thresholds, st.session_state['evaluation_cache'], 
+                                              st.session_state['evaluation_lock'], get_result_cache()))
+    steps = [functools.partial(price_scenario, sweep, threshold, n) for n, threshold in enumerate(thresholds)]
+    get_job_runner().submit(job_key, steps)
+    st.session_state['job_key'] = job_key
+
+# a rerun (mid-computation or after it) shows the session's latest job again
+job = get_job_runner().get(st.session_state['job_key']) if 'job_key' in st.session_state else None
+
+if job is None:
+    # if False:
+    st.title('Welcome to the Mortgage Simulator')
+    st.text('Please open the side bar and submit your values to simulate...')
+
+else:
+
     def table_footer():
         return st.html('''<sub>*** months_to_wait: Months until entering into mortgage<br>&emsp;cost_function: Total costs that sums rent paid until before entering a mortgage, the interest on the mortgage and the 
                 penalization of house appreciation against today's value as a cost of opportunity<br> 
@@ -160,51 +213,64 @@ else:
         
     with tab1:
 
+        # shown as soon as the submitted scenario is ready, the others keep running
+        with st.spinner('Simulating...'):
+            scenario = job.result(0)
+
             # Print the results
-        tab1.text(f"Optimal solution: Months to save until buying: {int(np.ceil(opt_result[0].x[0]))}, Mortgage Years: {int(np.ceil(opt_result[0].x[1]))}")
+        tab1.text(f"Optimal solution: Months to save until buying: {int(np.ceil(scenario['opt_result'].x[0]))}, Mortgage Years: {int(np.ceil(scenario['opt_result'].x[1]))}")
         tab1.text(f"""Optimal Total cost: Rents to save the needed money + Mortgage Interest 
-                         + House Appreciation Oportunity cost: {opt_result[0].fun}""")  
+                         + House Appreciation Oportunity cost: {scenario['opt_result'].fun}""")  
 
-        st.plotly_chart(table_plot[0], use_container_width=True, key = 'la_tablacsa') 
+        st.plotly_chart(scenario['table_plot'], use_container_width=True, key = 'la_tablacsa') 
 
         table_footer()
         
 
         r1_t1, r1_t2 = tab1.columns((1,1))       
 
-        r1_t2.plotly_chart(heat_plot[0], use_container_width=True)       
-        r1_t1.plotly_chart(plot_3d[0], use_container_width=True)   
+        r1_t2.plotly_chart(scenario['heat_plot'], use_container_width=True)       
+        r1_t1.plotly_chart(scenario['plot_3d'], use_container_width=True)   
 
         r2_t1, r2_t2 = tab1.columns((1,1))    
 
-        r2_t2.plotly_chart(scenarios_plot[0], use_container_width=True)       
-        r2_t2.plotly_chart(saving_mortgages_comp_plot[0], use_container_width=True)       
-        r2_t1.plotly_chart(cost_anal_plot[0][0], use_container_width=True)
-        r2_t1.plotly_chart(cost_anal_plot[0][1], use_container_width=True)
+        r2_t2.plotly_chart(scenario['scenarios_plot'], use_container_width=True)       
+        r2_t2.plotly_chart(scenario['saving_mortgages_comp_plot'], use_container_width=True)       
+        r2_t1.plotly_chart(scenario['cost_anal_plot'][0], use_container_width=True)
+        r2_t1.plotly_chart(scenario['cost_anal_plot'][1], use_container_width=True)
 
 
 
     with tab2:
 
-        for i in range(1, 3):
+        for i in range(1, len(job)):
+
+            with st.spinner('Simulating...'):
+                scenario = job.result(i)
         
-            tab2.html(f'''<h2>With Installment at {form_values['INSTALLMENT_THRESH'] + 500 * i}</h2>''')
+            tab2.html(f'''<h2>With Installment at {scenario['threshold']}</h2>''')
 
-            tab2.text(f"Optimal solution: Months to save until buying: {int(opt_result[i].x[0])}, Mortgage Years: {int(opt_result[i].x[1])}")
+            tab2.text(f"Optimal solution: Months to save until buying: {int(scenario['opt_result'].x[0])}, Mortgage Years: {int(scenario['opt_result'].x[1])}")
             tab2.text(f"""Optimal Total cost: Rents to save the needed money + Mortgage Interest 
-                         + House Appreciation Oportunity cost: {opt_result[i].fun}""")  
+                         + House Appreciation Oportunity cost: {scenario['opt_result'].fun}""")  
 
-            st.plotly_chart(table_plot[i], use_container_width=True) 
+            st.plotly_chart(scenario['table_plot'], use_container_width=True) 
 
             table_footer()
 
             r2_t1, r2_t2 = tab2.columns((1,1))    
 
-            r2_t2.plotly_chart(scenarios_plot[i], use_container_width=True)       
-            r2_t2.plotly_chart(heat_plot[i], use_container_width=True)       
-            r2_t1.plotly_chart(cost_anal_plot[i][0], use_container_width=True)
-            r2_t1.plotly_chart(cost_anal_plot[i][1], use_container_width=True)
+            r2_t2.plotly_chart(scenario['scenarios_plot'], use_container_width=True)       
+            r2_t2.plotly_chart(scenario['heat_plot'], use_container_width=True)       
+            r2_t1.plotly_chart(scenario['cost_anal_plot'][0], use_container_width=True)
+            r2_t1.plotly_chart(scenario['cost_anal_plot'][1], use_container_width=True)
+
 
+    if TRACER.enabled and job.trace is not None:
+        # one structured log line per span of this job (MORTGAGE_TRACE=1);
+        # other sessions' jobs keep their own spans
+        job.trace.log()
+        job.trace.reset()
 
 
     st.html('''<sub>Disclaimer: The calculator doesn't take into account taxes of any type (capital gains or property), insurance costs or any other cost no refer to in the dashboard</sub>''')
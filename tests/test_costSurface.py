@@ -0,0 +1,13 @@
+from dataFetcher import dataFetcher
+import benchmark
+import numpy as np
+
+
+def test_surface_with_numpy_params_round_trips(tmp_path):
+    inputs = dict(benchmark.default_inputs(), house_price = np.int64(950000), rent_price = np.float64(1900))
+    estimator = dataFetcher(**inputs, surface_storage = 'masked')
+    saved = estimator.save_surface(str(tmp_path))
+    loaded = estimator.load_surface(str(tmp_path))
+
+    assert loaded.params == estimator.params_key
+    assert np.array_equal(loaded.Z, saved.Z)
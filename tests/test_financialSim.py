@@ -0,0 +1,65 @@
+from backend import jitKernels
+from backend.evaluationCache import evaluationCache
+from backend.financialSim import financialEstimator
+from dataFetcher import dataFetcher
+import benchmark
+import numpy as np
+import pytest
+
+
+def infeasible_inputs():
+    # no installment is this low, so no point of the search box is feasible
+    return dict(benchmark.default_inputs(), intallment_threshold = 10)
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+# the kernels only price the scalar objective, the vectorized path runs NumPy either way
+@pytest.mark.parametrize('jit, vectorized', [(True, False), (False, False), (True, True)])
+@pytest.mark.parametrize('prune', [True, False])
+def test_all_infeasible_de_returns_inf(jit, prune, vectorized):
+    enabled = jitKernels.ENABLED
+    jitKernels.enable(jit)
+    try:
+        np.random.seed(0)
+        result, _ = financialEstimator(**infeasible_inputs()).run_simulation(prune = prune, vectorized = vectorized)
+    finally:
+        jitKernels.enable(enabled)
+    assert result.fun == np.inf
+    assert not result.success
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+def test_all_infeasible_fetcher_returns_inf():
+    np.random.seed(0)
+    result, _ = dataFetcher(**infeasible_inputs()).get_optimal_result()
+    assert result.fun == np.inf
+    assert not result.success
+
+
+def test_non_finite_points_are_infeasible():
+    estimator = financialEstimator(**benchmark.default_inputs())
+    assert estimator.objective_function([np.nan, 10.]) == np.inf
+    costs = estimator.population_objective(np.array([[np.nan, 164., np.inf], [10., 11., 5.]]))
+    assert costs[0] == np.inf and costs[2] == np.inf
+    assert costs[1] == estimator.objective_function([164., 11.])
+
+
+def test_surface_dtype_does_not_leak_through_the_cache():
+    cache = evaluationCache()
+    compact = financialEstimator(**benchmark.default_inputs(), optimizer = 'grid', surface_dtype = 'float32', cache = cache)
+    cold, _ = compact.run_simulation()
+    warm, _ = compact.run_simulation()
+    exact, _ = financialEstimator(**benchmark.default_inputs(), optimizer = 'grid', cache = cache).run_simulation()
+
+    assert cold.fun == warm.fun == exact.fun
+    assert (cold.x == warm.x).all() and (warm.x == exact.x).all()
+
+
+@pytest.mark.parametrize('progress_interval, throttled', [(0., False), (3600., True)])
+def test_fetcher_forwards_the_progress_interval(progress_interval, throttled):
+    lines = []
+    fetcher = dataFetcher(**benchmark.default_inputs(), progress = lines.append, progress_interval = progress_interval)
+    opt_verbose = fetcher.get_optimal_result()[1]
+
+    # a header and then one line per iteration, or only the first one within the interval
+    assert len(lines) == (2 if throttled else opt_verbose.callback_count + 1)
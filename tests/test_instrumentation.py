@@ -0,0 +1,28 @@
+from backend.instrumentation import stageTracer
+from backend.jobRunner import jobRunner
+
+
+def test_collected_spans_stay_out_of_the_shared_tracer(monkeypatch):
+    import backend.jobRunner
+    tracer = stageTracer(enabled = True)
+    monkeypatch.setattr(backend.jobRunner, 'TRACER', tracer)
+
+    def step(n):
+        with tracer.span('step', n = n):
+            tracer.count('steps')
+        return n
+
+    runner = jobRunner(max_workers = 2)
+    jobs = [runner.submit(key, [lambda key = key: step(key)]) for key in range(2)]
+    for job in jobs:
+        job.result(0)
+        job.future.result()
+    runner.shutdown()
+
+    with tracer.span('outside'):
+        pass
+    assert [span['name'] for span in tracer.spans] == ['outside']
+    assert tracer.counters == {'jobs_submitted': 2}
+    for key, job in enumerate(jobs):
+        assert [(span['name'], span['tags']) for span in job.trace.spans] == [('step', {'n': key}), ('job', {'steps': 1})]
+        assert job.trace.counters == {'steps': 1}
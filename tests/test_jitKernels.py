@@ -0,0 +1,23 @@
+from backend import jitKernels
+import benchmark
+import json
+import os
+import pytest
+import subprocess
+import sys
+
+
+VERIFY = 'import benchmark, json; from backend import jitKernels; print(json.dumps({"enabled": jitKernels.ENABLED, "errors": jitKernels.verify(benchmark.default_inputs())}))'
+
+
+@pytest.mark.skipif(not jitKernels.AVAILABLE, reason = 'numba is not installed')
+@pytest.mark.parametrize('jit', ['1', '0'])
+def test_kernels_match_numpy(jit):
+    # MORTGAGE_JIT is read at import, so every setting runs in its own interpreter
+    env = dict(os.environ, MORTGAGE_JIT = jit)
+    output = subprocess.run([sys.executable, '-c', VERIFY], cwd = benchmark.REPO_PATH, env = env, capture_output = True, text = True, check = True).stdout
+    result = json.loads(output.splitlines()[-1])
+
+    assert result['enabled'] == (jit == '1')
+    assert set(result['errors']) == {'objective_point', 'objective', 'objective_grid', 'amortization'}
+    assert max(result['errors'].values()) <= 1e-12
@@ -0,0 +1,33 @@
+from backend.financialSim import financialEstimator
+from backend.monteCarlo import rateModel, path_chunks, chunk_costs
+import benchmark
+import numpy as np
+import pytest
+
+
+MODELS = {
+    'house_price_growth': rateModel('lognormal', volatility = 0.01),
+    'monthly_mortgage_interes': rateModel('ar1', volatility = 0.0003, persistence = 0.98)
+}
+
+
+# several chunks merge histograms, a single one takes the exact percentiles
+@pytest.mark.parametrize('path_chunk', [200, 500])
+def test_chunked_percentiles_match_the_exact_ones(path_chunk):
+    estimator = financialEstimator(**benchmark.default_inputs())
+    months_wait, mortgage_years = estimator.search_axes()
+    result = estimator.monte_carlo(MODELS, paths = 500, percentiles = (0, 5, 50), seed = 1, path_chunk = path_chunk)
+
+    costs = [[] for _ in mortgage_years]
+    for chunk in chunk_costs(estimator.init_kwargs, MODELS, path_chunks(1, 500, path_chunk), months_wait, mortgage_years):
+        for j, cost in chunk:
+            costs[j].append(cost)
+    costs = [np.vstack(cost) for cost in costs]
+
+    assert np.array_equal(result['feasible_probability'], np.array([np.isfinite(cost).mean(axis = 0) for cost in costs]))
+    assert np.isclose(result['optimal_probability'].sum(), np.isfinite(np.array(costs)).any(axis = (0, 2)).mean())
+    for q, surface in result['percentiles'].items():
+        exact = np.array([np.percentile(cost, q, axis = 0, method = 'inverted_cdf') for cost in costs])
+        finite = np.isfinite(exact)
+        assert np.array_equal(finite, np.isfinite(surface))
+        assert np.allclose(surface[finite], exact[finite], rtol = 1e-2)
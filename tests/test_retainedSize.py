@@ -0,0 +1,40 @@
+from backend.costSurface import costSurface
+from dataFetcher import dataFetcher
+import benchmark
+import numpy as np
+
+
+def finished_fetcher(**kwargs):
+    fetcher = dataFetcher(**benchmark.default_inputs(), optimizer = 'grid', **kwargs)
+    fetcher.get_scenarios()
+    return fetcher
+
+
+def component_arrays(cache):
+    for value in cache._components.values():
+        yield from (item for item in (value if isinstance(value, tuple) else (value,)) if item is not None)
+
+
+def retained_bytes(fetcher):
+    """Bytes the evaluation cache holds in surfaces and components."""
+    surfaces = sum(surface.nbytes for surface in fetcher.cache._surfaces.values())
+    return surfaces + sum(np.asarray(item).nbytes for item in component_arrays(fetcher.cache))
+
+
+def test_cache_keeps_no_dense_grids():
+    fetcher = finished_fetcher(surface_dtype = 'float32', surface_storage = 'masked')
+    grid_size = fetcher.grid_surface.shape[0] * fetcher.grid_surface.shape[1]
+
+    assert fetcher.cache._surfaces
+    for surface in fetcher.cache._surfaces.values():
+        assert isinstance(surface, costSurface)
+        assert surface.storage == 'masked' and surface.dtype == np.float32
+    assert all(np.size(item) < grid_size for item in component_arrays(fetcher.cache))
+
+
+def test_compact_surfaces_retain_less():
+    dense = finished_fetcher()
+    compact = finished_fetcher(surface_dtype = 'float32', surface_storage = 'masked')
+
+    assert compact.grid_surface.nbytes < dense.grid_surface.nbytes / 2
+    assert retained_bytes(compact) < retained_bytes(dense) / 2